@@ -0,0 +1,440 @@
+import argparse
+import array
+import copy
+import itertools
+import math
+import random
+from derivation import DerivationEncoder
+from option import Option
+from optimizer import optimize
+from project4 import Grammar
+from random_access import sentence_at
+from rule import Rule
+from symbols import TerminalSymbol, VariableSymbol
+from vocabulary import Vocabulary, generate_tokens
+
+
+# Bins with fewer observations than this are pooled before a chi-square test
+MIN_BIN_COUNT = 10
+
+
+def make_synthetic_grammar(generator, rule_count = 8, max_options = 6, max_symbols = 4, max_weight = 9):
+    """Builds a random grammar whose start variable is R0. Rule Ri only refers to
+    rules after it, so every sentence is finite. Some weights are zero, to
+    exercise the boundaries of the cumulative scan."""
+    grammar = Grammar()
+
+    for i in range(rule_count):
+        options = []
+        for x in range(generator.randint(1, max_options)):
+            symbols = []
+            for y in range(generator.randint(1, max_symbols)):
+                if i + 1 < rule_count and generator.random() < 0.4:
+                    symbols.append(VariableSymbol(f"R{generator.randint(i + 1, rule_count - 1)}"))
+                else:
+                    symbols.append(TerminalSymbol(f"w{generator.randint(0, 30)}"))
+            options.append(Option(generator.randint(0, max_weight), symbols))
+
+        if all(option.weight == 0 for option in options):
+            options[0].weight = 1
+        grammar.add_rule(Rule(f"R{i}", options))
+
+    return grammar
+
+
+def reference_choose(rule, generator):
+    """Picks an option the way Rule.generate_rule always has: a uniform draw over
+    the weight sum, then the first option whose running total is >= the draw"""
+    sum_weight = sum(option.weight for option in rule.options)
+    if sum_weight == 0:
+        return None
+
+    chosen_option = generator.uniform(0, sum_weight)
+    current_weight = 0
+    for index, option in enumerate(rule.options):
+        current_weight += option.weight
+        if chosen_option <= current_weight:
+            return index
+    return None
+
+
+def _reference_sentence(grammar, variable, generator):
+    """Generates a sentence with reference_choose"""
+    rule = grammar.rules[variable]
+    option = rule.options[reference_choose(rule, generator)]
+    return ' '.join(_reference_sentence(grammar, symbol.name, generator)
+                    if isinstance(symbol, VariableSymbol) else symbol.value
+                    for symbol in option.symbols)
+
+
+def _copy_grammar(grammar):
+    """Returns a grammar with fresh rules around the same options"""
+    copied = Grammar()
+    for name, rule in grammar.rules.items():
+        copied.add_rule(Rule(rule.variable, rule.options))
+    return copied
+
+
+def _with_generator(grammar, generator):
+    """Returns a view of a grammar that draws from the given generator"""
+    if grammar.frozen:
+        return grammar.with_random(generator)
+    view = copy.copy(grammar)
+    view.random = generator
+    return view
+
+
+class Engine:
+    """Class for a way of generating from a grammar. An engine that is seed
+    compatible must give exactly the reference sentences for the same seed, and
+    one with same_distribution must give sentences distributed like them."""
+    name = 'rule'
+    seed_compatible = True
+    same_distribution = True
+    picks_options = True
+
+    def prepare(self, grammar):
+        """Returns the state the engine generates from"""
+        return _copy_grammar(grammar)
+
+    def option_weights(self, state, variable):
+        """Returns the weights the options of a rule should be picked by"""
+        return [option.weight for option in state.rules[variable].options]
+
+    def bind(self, state, generator):
+        """Returns the state set up to draw from the given generator"""
+        return _with_generator(state, generator)
+
+    def choose(self, bound, variable):
+        """Returns the index of an option of a rule"""
+        return bound.rules[variable].choose_option(bound)
+
+    def sentence(self, bound, start_variable):
+        """Returns a sentence"""
+        return bound.output_sentence(start_variable)
+
+
+class ReferenceEngine(Engine):
+    name = 'reference'
+
+    def prepare(self, grammar):
+        return grammar
+
+    def bind(self, state, generator):
+        return state, generator
+
+    def choose(self, bound, variable):
+        grammar, generator = bound
+        return reference_choose(grammar.rules[variable], generator)
+
+    def sentence(self, bound, start_variable):
+        grammar, generator = bound
+        return _reference_sentence(grammar, start_variable, generator)
+
+
+class FrozenEngine(Engine):
+    name = 'frozen'
+
+    def prepare(self, grammar):
+        return _copy_grammar(grammar).freeze()
+
+
+class FenwickEngine(Engine):
+    name = 'fenwick'
+
+    def prepare(self, grammar):
+        state = _copy_grammar(grammar)
+        for rule in state.rules.values():
+            if rule.options:
+                rule.set_weight(0, rule.options[0].weight)
+        return state
+
+
+class UpdateEngine(Engine):
+    """Applies many random fractional set_weight updates before generating, then
+    sets some weights to 0, so the Fenwick tree carries rounding error and its
+    options must still follow the updated weights"""
+    name = 'updates'
+    seed_compatible = False
+    same_distribution = False
+
+    def __init__(self, updates = 200, seed = 0):
+        self.updates = updates
+        self.seed = seed
+
+    def prepare(self, grammar):
+        generator = random.Random(self.seed)
+        state = _copy_grammar(grammar)
+
+        for rule in state.rules.values():
+            for x in range(self.updates):
+                rule.set_weight(generator.randrange(len(rule.options)), generator.uniform(0, 9))
+            for index in range(len(rule.options)):
+                others = rule.options[:index] + rule.options[index + 1:]
+                if generator.random() < 0.3 and any(option.weight > 0 for option in others):
+                    rule.set_weight(index, 0)
+        return state
+
+
+class RandomAccessEngine(Engine):
+    """Generates sentence after sentence of a seeded corpus with sentence_at"""
+    name = 'sentence_at'
+    seed_compatible = False
+    picks_options = False
+
+    def prepare(self, grammar):
+        return _copy_grammar(grammar).freeze()
+
+    def bind(self, state, generator):
+        return state, generator.getrandbits(64), itertools.count()
+
+    def sentence(self, bound, start_variable):
+        grammar, seed, indexes = bound
+        return sentence_at(grammar, start_variable, seed, next(indexes))
+
+
+class DerivationEngine(Engine):
+    name = 'derivation'
+    picks_options = False
+
+    def bind(self, state, generator):
+        return DerivationEncoder(_with_generator(state, generator))
+
+    def sentence(self, bound, start_variable):
+        return bound.sentence(bound.derive(start_variable))
+
+
+class TokenEngine(Engine):
+    name = 'tokens'
+    picks_options = False
+
+    def bind(self, state, generator):
+        return _with_generator(state, generator), Vocabulary.from_grammar(state)
+
+    def sentence(self, bound, start_variable):
+        grammar, vocabulary = bound
+        tokens = array.array('I')
+        generate_tokens(grammar, vocabulary, start_variable, tokens)
+        return ' '.join(vocabulary.words[token] for token in tokens)
+
+
+class OptimizedEngine(Engine):
+    name = 'optimized'
+    seed_compatible = False
+    picks_options = False
+
+    def prepare(self, grammar):
+        optimized, report = optimize(grammar)
+        return optimized
+
+
+ENGINES = [Engine(), FrozenEngine(), FenwickEngine(), UpdateEngine(), RandomAccessEngine(),
+           DerivationEngine(), TokenEngine(), OptimizedEngine()]
+
+
+def chi_square_sf(statistic, degrees):
+    """Returns the chance that a chi-square variable with the given degrees of
+    freedom is at least statistic, the regularized upper incomplete gamma Q(k/2, x/2)"""
+    if degrees <= 0:
+        return 1.0
+    a = degrees / 2
+    x = statistic / 2
+    if x <= 0:
+        return 1.0
+
+    log_front = a * math.log(x) - x - math.lgamma(a)
+
+    if x < a + 1:
+        # Series for the lower part P(a, x)
+        term = total = 1 / a
+        denominator = a
+        while abs(term) > abs(total) * 1e-15:
+            denominator += 1
+            term *= x / denominator
+            total += term
+        return max(0.0, 1.0 - total * math.exp(log_front))
+
+    # Continued fraction for Q(a, x) by the modified Lentz method
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    fraction = d
+    for i in range(1, 10000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        fraction *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, math.exp(log_front) * fraction)
+
+
+def goodness_of_fit(counts, probabilities):
+    """Returns the chi-square statistic, degrees of freedom and p-value of observed
+    counts against expected probabilities, pooling bins expected to be small"""
+    total = sum(counts)
+    observed = []
+    expected = []
+    pooled_observed = pooled_expected = 0
+
+    for count, probability in zip(counts, probabilities):
+        if probability == 0:
+            if count:
+                return math.inf, 0, 0.0
+            continue
+        if total * probability < MIN_BIN_COUNT:
+            pooled_observed += count
+            pooled_expected += total * probability
+        else:
+            observed.append(count)
+            expected.append(total * probability)
+
+    if pooled_expected:
+        observed.append(pooled_observed)
+        expected.append(pooled_expected)
+
+    statistic = sum((o - e) ** 2 / e for o, e in zip(observed, expected))
+    return statistic, len(observed) - 1, chi_square_sf(statistic, len(observed) - 1)
+
+
+def homogeneity(first, second):
+    """Returns the chi-square statistic, degrees of freedom and p-value of whether
+    two histograms (dictionaries of counts) come from the same distribution"""
+    first_total = sum(first.values())
+    second_total = sum(second.values())
+    bins = []
+    pooled = [0, 0]
+
+    for key in sorted(set(first) | set(second)):
+        pair = [first.get(key, 0), second.get(key, 0)]
+        if sum(pair) < MIN_BIN_COUNT:
+            pooled = [pooled[0] + pair[0], pooled[1] + pair[1]]
+        else:
+            bins.append(pair)
+    if sum(pooled):
+        bins.append(pooled)
+
+    statistic = 0.0
+    for a, b in bins:
+        column = a + b
+        for count, total in ((a, first_total), (b, second_total)):
+            expected = column * total / (first_total + second_total)
+            statistic += (count - expected) ** 2 / expected
+    return statistic, len(bins) - 1, chi_square_sf(statistic, len(bins) - 1)
+
+
+class ConformanceResult:
+    """Class for the outcome of one check of one engine"""
+    def __init__(self, engine, check, passed, detail):
+        self.engine = engine
+        self.check = check
+        self.passed = passed
+        self.detail = detail
+
+    def __str__(self):
+        return f"{'PASSED' if self.passed else 'FAILED':8}{self.engine:12}{self.check:22}{self.detail}"
+
+
+def check_option_frequencies(engine, grammar, draws, generator, alpha):
+    """Draws options of every rule and tests them against the weights of the
+    engine's prepared grammar"""
+    state = engine.prepare(grammar)
+    bound = engine.bind(state, generator)
+    worst = 1.0
+    failures = []
+
+    for name in grammar.rules:
+        weights = engine.option_weights(state, name)
+        sum_weight = sum(weights)
+        if len(weights) < 2:
+            continue
+
+        counts = [0] * len(weights)
+        for x in range(draws):
+            counts[engine.choose(bound, name)] += 1
+
+        statistic, degrees, p_value = goodness_of_fit(counts, [weight / sum_weight for weight in weights])
+        worst = min(worst, p_value)
+        if p_value < alpha:
+            failures.append(f"{name} (p={p_value:.3g})")
+
+    detail = f"worst p={worst:.3g}" + (f", off: {', '.join(failures)}" if failures else '')
+    return ConformanceResult(engine.name, 'option frequencies', not failures, detail)
+
+
+def _length_histogram(engine, grammar, start_variable, count, generator):
+    bound = engine.bind(engine.prepare(grammar), generator)
+    histogram = {}
+    for x in range(count):
+        length = len(engine.sentence(bound, start_variable).split())
+        histogram[length] = histogram.get(length, 0) + 1
+    return histogram
+
+
+def check_sentence_lengths(engine, grammar, start_variable, count, generator, alpha):
+    """Compares the sentence lengths of an engine with those of the reference"""
+    expected = _length_histogram(ReferenceEngine(), grammar, start_variable, count, generator)
+    observed = _length_histogram(engine, grammar, start_variable, count, generator)
+    statistic, degrees, p_value = homogeneity(expected, observed)
+    return ConformanceResult(engine.name, 'sentence lengths', p_value >= alpha, f"p={p_value:.3g}")
+
+
+def check_seed_equality(engine, grammar, start_variable, count, seed):
+    """Checks that a seed compatible engine gives exactly the reference sentences"""
+    reference = ReferenceEngine()
+    expected_bound = reference.bind(reference.prepare(grammar), random.Random(seed))
+    expected = [reference.sentence(expected_bound, start_variable) for x in range(count)]
+
+    bound = engine.bind(engine.prepare(grammar), random.Random(seed))
+    for index, sentence in enumerate(expected):
+        actual = engine.sentence(bound, start_variable)
+        if actual != sentence:
+            return ConformanceResult(engine.name, 'seed equality', False,
+                                     f"sentence {index}: {actual!r} != {sentence!r}")
+    return ConformanceResult(engine.name, 'seed equality', True, f"{count} sentence(s) equal")
+
+
+def run_conformance(engines = ENGINES, grammar_count = 3, draws = 1000000, sentences = 100000,
+                    seed = 0, alpha = 1e-6):
+    """Runs every check of every engine on synthetic grammars and returns the results"""
+    generator = random.Random(seed)
+    results = []
+
+    for index in range(grammar_count):
+        grammar = make_synthetic_grammar(generator)
+        for engine in engines:
+            if engine.picks_options:
+                results.append(check_option_frequencies(engine, grammar, draws, generator, alpha))
+            if engine.same_distribution:
+                results.append(check_sentence_lengths(engine, grammar, "R0", sentences, generator, alpha))
+            if engine.seed_compatible:
+                results.append(check_seed_equality(engine, grammar, "R0", sentences, generator.getrandbits(64)))
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = 'Checks that every engine generates like Rule.generate_rule.')
+    parser.add_argument('--grammars', type = int, default = 3)
+    parser.add_argument('--draws', type = int, default = 1000000, help = 'option draws per rule')
+    parser.add_argument('--sentences', type = int, default = 100000)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--alpha', type = float, default = 1e-6)
+    args = parser.parse_args()
+
+    results = run_conformance(ENGINES, args.grammars, args.draws, args.sentences, args.seed, args.alpha)
+    for result in results:
+        print(result)
+
+    if not all(result.passed for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,310 @@
+import bisect
+from itertools import accumulate
+from symbols import VariableSymbol
+
+
+# The fixed-point iteration over recursive rules stops once no probability
+# changes by more than this, or after this many rounds
+TOLERANCE = 1e-15
+MAX_ITERATIONS = 10000
+
+
+def _reachable_rules(grammar, start_variable):
+    """Returns the rules of the grammar reachable from the start variable, by name.
+    Rules are looked up with get_rule, so a LazyGrammar parses the ones it reaches."""
+    rules = {}
+    pending = [start_variable]
+
+    while pending:
+        name = pending.pop()
+        if name in rules or not grammar.has_rule(name):
+            continue
+
+        rules[name] = grammar.get_rule(name)
+        for option in rules[name].options:
+            for symbol in option.symbols:
+                if isinstance(symbol, VariableSymbol):
+                    pending.append(symbol.name)
+
+    return rules
+
+
+def _option_probabilities(rule):
+    """Returns the probability of each option of a rule"""
+    sum_weight = sum(option.weight for option in rule.options)
+    if sum_weight == 0:
+        return [0.0] * len(rule.options)
+    return [option.weight / sum_weight for option in rule.options]
+
+
+def _is_static(rule):
+    """Tells whether a rule has only terminals, so its probabilities never change"""
+    return not any(isinstance(symbol, VariableSymbol)
+                   for option in rule.options for symbol in option.symbols)
+
+
+class _ConstrainedSampler:
+    """Base class for samplers that only produce sentences meeting a constraint.
+    Subclasses keep per-rule probability tables that the constructor solves."""
+    def __init__(self, grammar, start_variable):
+        """Solves the tables for every rule reachable from the start variable"""
+        self.grammar = grammar
+        self.start_variable = start_variable
+        self.rules = _reachable_rules(grammar, start_variable)
+        self.probabilities = {name: _option_probabilities(rule) for name, rule in self.rules.items()}
+        self._option_choices = {}
+
+        for name, rule in self.rules.items():
+            if _is_static(rule):
+                self._update(name)
+
+        recursive = [name for name, rule in self.rules.items() if not _is_static(rule)]
+        for iteration in range(MAX_ITERATIONS):
+            if max((self._update(name) for name in recursive), default = 0.0) <= TOLERANCE:
+                break
+
+        # Chance that an unconstrained sentence already meets the constraint
+        self.probability = self._start_probability()
+        if self.probability <= 0:
+            raise ValueError(f"No sentence from {start_variable} can meet the constraint.")
+
+    def _pick(self, weights):
+        """Returns an index drawn in proportion to the given weights"""
+        cumulative = list(accumulate(weights))
+        return self._pick_cumulative(cumulative)
+
+    def _pick_cumulative(self, cumulative):
+        """Returns an index drawn from running totals of weights"""
+        chosen = self.grammar.random.random() * cumulative[-1]
+        return min(bisect.bisect_right(cumulative, chosen), len(cumulative) - 1)
+
+    def _pick_option(self, key, name, weight_of):
+        """Picks an option of a rule by constrained weight. The running totals are
+        worked out the first time each key is seen and reused afterwards."""
+        if key not in self._option_choices:
+            rule = self.rules[name]
+            self._option_choices[key] = tuple(accumulate(
+                probability * weight_of(option.symbols) if probability else 0.0
+                for probability, option in zip(self.probabilities[name], rule.options)))
+        return self.rules[name].options[self._pick_cumulative(self._option_choices[key])]
+
+    def samples(self, count):
+        """Returns a list of count sentences that meet the constraint"""
+        return [self.sample() for x in range(count)]
+
+
+class ContainsSampler(_ConstrainedSampler):
+    """Samples sentences that contain at least one of the given words, with the
+    same distribution as drawing sentences and throwing away the rest"""
+    def __init__(self, grammar, start_variable, words):
+        """Takes a single word or an iterable of words"""
+        self.words = frozenset([words] if isinstance(words, str) else words)
+        # Chance that each rule's sentence contains one of the words
+        self.contain_probability = {}
+        super().__init__(grammar, start_variable)
+
+    def _symbol_probability(self, symbol):
+        """Chance that what the symbol generates contains one of the words"""
+        if isinstance(symbol, VariableSymbol):
+            return self.contain_probability.get(symbol.name, 0.0)
+        return 1.0 if any(word in self.words for word in symbol.value.split()) else 0.0
+
+    def _miss_probability(self, symbols):
+        """Chance that none of the symbols generates one of the words"""
+        miss = 1.0
+        for symbol in symbols:
+            miss *= 1.0 - self._symbol_probability(symbol)
+        return miss
+
+    def _update(self, name):
+        """Recomputes a rule's probability and returns how much it changed"""
+        new = sum(probability * (1.0 - self._miss_probability(option.symbols))
+                  for probability, option in zip(self.probabilities[name], self.rules[name].options)
+                  if probability)
+        old = self.contain_probability.get(name, 0.0)
+        self.contain_probability[name] = new
+        return abs(new - old)
+
+    def _start_probability(self):
+        return self.contain_probability.get(self.start_variable, 0.0)
+
+    def sample(self):
+        """Returns one sentence that contains one of the words"""
+        return self._sample_rule(self.start_variable, True)
+
+    def _sample_rule(self, name, contains):
+        """Generates from a rule, given whether its sentence must contain a word or
+        must not"""
+        if contains:
+            option = self._pick_option((name, True), name, lambda symbols: 1.0 - self._miss_probability(symbols))
+        else:
+            option = self._pick_option((name, False), name, self._miss_probability)
+        return self._sample_symbols(option.symbols, contains)
+
+    def _sample_symbol(self, symbol, contains):
+        if isinstance(symbol, VariableSymbol):
+            return self._sample_rule(symbol.name, contains)
+        return symbol.value
+
+    def _sample_symbols(self, symbols, contains):
+        """Generates a sequence of symbols, deciding one symbol at a time whether it
+        is the first to contain a word"""
+        if not contains:
+            return ' '.join(self._sample_symbol(symbol, False) for symbol in symbols)
+
+        parts = []
+        found = False
+        for index, symbol in enumerate(symbols):
+            if found:
+                parts.append(symbol.generate(self.grammar))
+                continue
+
+            probability = self._symbol_probability(symbol)
+            remaining = 1.0 - self._miss_probability(symbols[index:])
+            if self.grammar.random.random() * remaining < probability:
+                parts.append(self._sample_symbol(symbol, True))
+                found = True
+            else:
+                parts.append(self._sample_symbol(symbol, False))
+        return ' '.join(parts)
+
+
+class PrefixSampler(_ConstrainedSampler):
+    """Samples sentences whose words start with the given prefix, with the same
+    distribution as drawing sentences and throwing away the rest.
+
+    For each rule X and prefix position i it solves cover[X][i], the chance that
+    X's words start with prefix[i:], and span[X][i][m], the chance that X's words
+    are exactly prefix[i:m] for m before the end of the prefix."""
+    def __init__(self, grammar, start_variable, prefix):
+        """Takes the prefix as a string of words or a sequence of words"""
+        self.prefix = tuple(prefix.split()) if isinstance(prefix, str) else tuple(prefix)
+        if not self.prefix:
+            raise ValueError("The prefix must have at least one word.")
+        self.cover = {}
+        self.span = {}
+        super().__init__(grammar, start_variable)
+
+    def _symbol_cover(self, symbol, i):
+        if isinstance(symbol, VariableSymbol):
+            cover = self.cover.get(symbol.name)
+            return cover[i] if cover else 0.0
+        words = symbol.value.split()
+        return 1.0 if tuple(words[:len(self.prefix) - i]) == self.prefix[i:] else 0.0
+
+    def _symbol_span(self, symbol, i, m):
+        if isinstance(symbol, VariableSymbol):
+            span = self.span.get(symbol.name)
+            return span[i][m] if span else 0.0
+        return 1.0 if tuple(symbol.value.split()) == self.prefix[i:m] else 0.0
+
+    def _sequence_tables(self, symbols):
+        """Returns the cover and span tables of every suffix of a symbol sequence,
+        where the tables at index j describe symbols[j:]"""
+        size = len(self.prefix)
+        covers = [[0.0] * size]
+        spans = [[[1.0 if i == m else 0.0 for m in range(size)] for i in range(size)]]
+
+        for symbol in reversed(symbols):
+            next_cover, next_span = covers[0], spans[0]
+            cover = []
+            span = [[0.0] * size for i in range(size)]
+            for i in range(size):
+                symbol_spans = [self._symbol_span(symbol, i, l) if l >= i else 0.0 for l in range(size)]
+                cover.append(self._symbol_cover(symbol, i) + sum(
+                    symbol_spans[l] * next_cover[l] for l in range(i, size) if symbol_spans[l]))
+                for m in range(i, size):
+                    span[i][m] = sum(
+                        symbol_spans[l] * next_span[l][m] for l in range(i, m + 1) if symbol_spans[l])
+            covers.insert(0, cover)
+            spans.insert(0, span)
+
+        return covers, spans
+
+    def _update(self, name):
+        """Recomputes a rule's tables and returns how much they changed"""
+        size = len(self.prefix)
+        cover = [0.0] * size
+        span = [[0.0] * size for i in range(size)]
+
+        for probability, option in zip(self.probabilities[name], self.rules[name].options):
+            if not probability:
+                continue
+            covers, spans = self._sequence_tables(option.symbols)
+            for i in range(size):
+                cover[i] += probability * covers[0][i]
+                for m in range(i, size):
+                    span[i][m] += probability * spans[0][i][m]
+
+        old_cover = self.cover.get(name, [0.0] * size)
+        old_span = self.span.get(name, [[0.0] * size for i in range(size)])
+        self.cover[name] = cover
+        self.span[name] = span
+        return max(max(abs(a - b) for a, b in zip(cover, old_cover)),
+                   max(abs(a - b) for row, old_row in zip(span, old_span) for a, b in zip(row, old_row)))
+
+    def _start_probability(self):
+        cover = self.cover.get(self.start_variable)
+        return cover[0] if cover else 0.0
+
+    def sample(self):
+        """Returns one sentence that starts with the prefix"""
+        return self._sample_cover(self.start_variable, 0)
+
+    def _sample_cover(self, name, i):
+        """Generates from a rule whose words must start with prefix[i:]"""
+        option = self._pick_option(
+            ('cover', name, i), name, lambda symbols: self._sequence_tables(symbols)[0][0][i])
+        covers, spans = self._sequence_tables(option.symbols)
+
+        parts = []
+        covered = False
+        for index, symbol in enumerate(option.symbols):
+            if covered:
+                parts.append(symbol.generate(self.grammar))
+                continue
+
+            ends = list(range(i, len(self.prefix)))
+            choice = self._pick([self._symbol_cover(symbol, i)] + [
+                self._symbol_span(symbol, i, m) * covers[index + 1][m] for m in ends])
+            if choice == 0:
+                parts.append(self._sample_symbol_cover(symbol, i))
+                covered = True
+            else:
+                parts.append(self._sample_symbol_span(symbol, i, ends[choice - 1]))
+                i = ends[choice - 1]
+        return ' '.join(parts)
+
+    def _sample_span(self, name, i, m):
+        """Generates from a rule whose words must be exactly prefix[i:m]"""
+        option = self._pick_option(
+            ('span', name, i, m), name, lambda symbols: self._sequence_tables(symbols)[1][0][i][m])
+        covers, spans = self._sequence_tables(option.symbols)
+
+        parts = []
+        for index, symbol in enumerate(option.symbols):
+            ends = list(range(i, m + 1))
+            choice = self._pick([self._symbol_span(symbol, i, l) * spans[index + 1][l][m] for l in ends])
+            parts.append(self._sample_symbol_span(symbol, i, ends[choice]))
+            i = ends[choice]
+        return ' '.join(parts)
+
+    def _sample_symbol_cover(self, symbol, i):
+        if isinstance(symbol, VariableSymbol):
+            return self._sample_cover(symbol.name, i)
+        return symbol.value
+
+    def _sample_symbol_span(self, symbol, i, m):
+        if isinstance(symbol, VariableSymbol):
+            return self._sample_span(symbol.name, i, m)
+        return symbol.value
+
+
+def constrained_sampler(grammar, start_variable, prefix = None, contains = None):
+    """Returns a sampler for sentences that start with prefix or that contain one
+    of the words in contains. Exactly one of the two must be given."""
+    if (prefix is None) == (contains is None):
+        raise ValueError("Give exactly one of prefix or contains.")
+    if prefix is not None:
+        return PrefixSampler(grammar, start_variable, prefix)
+    return ContainsSampler(grammar, start_variable, contains)
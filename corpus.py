@@ -0,0 +1,80 @@
+import argparse
+from project4 import grammar_parser
+from random_access import generate_range, parse_range, parse_shard, shard_range
+from sinks import DEFAULT_QUEUE_SIZE, BackgroundWriter
+from vocabulary import write_token_corpus
+
+
+# Number of sentences handed to the writer at a time
+DEFAULT_BATCH_SIZE = 1000
+
+
+def generate_corpus(grammar, start_variable, count, writer, batch_size = DEFAULT_BATCH_SIZE,
+                    seed = None, first = 0):
+    """Generates count sentences and hands them to the writer in batches. With a
+    seed, they are sentences first to first + count of that seed's corpus."""
+    for start in range(first, first + count, batch_size):
+        stop = min(start + batch_size, first + count)
+        if seed is None:
+            batch = (grammar.output_sentence(start_variable) for x in range(start, stop))
+        else:
+            batch = generate_range(grammar, start_variable, seed, start, stop)
+        writer.write_batch(str(sentence) for sentence in batch)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = 'Generates a corpus of random sentences.')
+    parser.add_argument('grammar')
+    parser.add_argument('count', type = int)
+    parser.add_argument('start_variable')
+    parser.add_argument('-o', '--output', default = '-',
+                        help = 'file to write, compressed by its extension (.gz, .bz2, .xz, .lzma)')
+    parser.add_argument('--compression', default = 'auto',
+                        choices = ['auto', 'none', 'gzip', 'bz2', 'xz', 'lzma'])
+    parser.add_argument('--seed', type = int, default = None,
+                        help = 'make sentence i depend only on the seed and i')
+    parser.add_argument('--shard', type = parse_shard, default = None, metavar = 'K/N',
+                        help = 'write only shard K (counting from 0) of N equal shards')
+    parser.add_argument('--range', type = parse_range, default = None, metavar = 'A:B',
+                        help = 'write only sentences A up to B')
+    parser.add_argument('--tokens', action = 'store_true',
+                        help = 'write token ids to OUTPUT.tokens.npy and OUTPUT.offsets.npy '
+                               'with the words in OUTPUT.vocab.txt')
+    parser.add_argument('--batch-size', type = int, default = DEFAULT_BATCH_SIZE)
+    parser.add_argument('--queue-size', type = int, default = DEFAULT_QUEUE_SIZE)
+    parser.add_argument('--process', action = 'store_true',
+                        help = 'compress in a separate process instead of a thread')
+    args = parser.parse_args()
+
+    first, stop = 0, args.count
+    if args.shard is not None and args.range is not None:
+        parser.error('--shard and --range cannot be used together')
+    if args.shard is not None:
+        shard, shards = args.shard
+        if not 0 <= shard < shards:
+            parser.error('--shard K/N needs 0 <= K < N')
+        first, stop = shard_range(args.count, shard, shards)
+    if args.range is not None:
+        first, stop = args.range
+        if not 0 <= first <= stop <= args.count:
+            parser.error(f'--range must be within 0:{args.count}')
+    if (args.shard is not None or args.range is not None) and args.seed is None:
+        parser.error('--shard and --range need a --seed')
+
+    grammar = grammar_parser(args.grammar)
+
+    if args.tokens:
+        if args.output == '-':
+            parser.error('--tokens needs an --output prefix')
+        write_token_corpus(args.output, grammar, args.start_variable, stop - first, args.seed, first)
+        return
+
+    compression = None if args.compression == 'none' else args.compression
+
+    with BackgroundWriter(args.output, compression, args.queue_size, args.process) as writer:
+        generate_corpus(grammar, args.start_variable, stop - first, writer, args.batch_size,
+                        args.seed, first)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+import array
+import json
+import struct
+import sys
+from symbols import VariableSymbol
+
+
+# Bytes at the start of every file written by write_derivations
+MAGIC = b'GSDV'
+
+# Number of uint32 values collected before write_derivations writes to the file
+WRITE_BUFFER_SIZE = 1 << 16
+
+# Number of uint32 values read_derivations reads from the file at a time
+READ_BUFFER_SIZE = 1 << 16
+
+
+class DerivationEncoder:
+    """Generates derivation trees as flat arrays instead of sentences. A derivation
+    lists every rule expansion in preorder as a (rule id, option index) pair of
+    uint32 values, where a rule's id is its position in rule_names."""
+    def __init__(self, grammar, rule_names = None):
+        """Numbers the rules of the grammar in the given order. By default that is
+        the order of the grammar's file, which for a LazyGrammar comes from its
+        index so the ids do not depend on which rules were loaded first."""
+        self.grammar = grammar
+        if rule_names is None:
+            rule_names = list(getattr(grammar, 'index', {}))
+            rule_names.extend(name for name in grammar.rules if name not in rule_names)
+        self.rule_names = list(rule_names)
+        self.rule_ids = {name: rule_id for rule_id, name in enumerate(self.rule_names)}
+
+    def derive(self, start_variable):
+        """Returns the derivation of one random sentence as an array('I'), or None
+        if generation failed. It draws the same random numbers as
+        Grammar.output_sentence, so both give the same sentence for a seed."""
+        encoding = array.array('I')
+        if not self._derive(start_variable, encoding):
+            return None
+        return encoding
+
+    def _derive(self, variable, encoding):
+        """Appends the derivation of a variable and returns whether it succeeded"""
+        rule = self.grammar.get_rule(variable)
+        if rule is None:
+            return False
+
+        index = rule.choose_option(self.grammar)
+        if index is None:
+            return False
+
+        encoding.append(self.rule_ids[variable])
+        encoding.append(index)
+
+        for symbol in rule.options[index].symbols:
+            if isinstance(symbol, VariableSymbol) and not self._derive(symbol.name, encoding):
+                return False
+        return True
+
+    def decode(self, encoding):
+        """Turns a derivation into a tree of nested dictionaries, where each node
+        holds its rule, its option index and its children, with terminals as strings"""
+        tree, position = self._decode(encoding, 0)
+        return tree
+
+    def _decode(self, encoding, position):
+        """Decodes the node at position and returns it with the position after it"""
+        name = self.rule_names[encoding[position]]
+        index = encoding[position + 1]
+        position += 2
+
+        children = []
+        for symbol in self.grammar.get_rule(name).options[index].symbols:
+            if isinstance(symbol, VariableSymbol):
+                child, position = self._decode(encoding, position)
+                children.append(child)
+            else:
+                children.append(symbol.value)
+
+        return {'rule': name, 'option': index, 'children': children}, position
+
+    def to_json(self, encoding):
+        """Returns the decoded tree of a derivation as JSON text"""
+        return json.dumps(self.decode(encoding))
+
+    def sentence(self, encoding):
+        """Returns the sentence a derivation produces"""
+        sentence, position = self._sentence(encoding, 0)
+        return sentence
+
+    def _sentence(self, encoding, position):
+        """Returns the text of the node at position with the position after it"""
+        name = self.rule_names[encoding[position]]
+        index = encoding[position + 1]
+        position += 2
+
+        parts = []
+        for symbol in self.grammar.get_rule(name).options[index].symbols:
+            if isinstance(symbol, VariableSymbol):
+                part, position = self._sentence(encoding, position)
+                parts.append(part)
+            else:
+                parts.append(symbol.value)
+
+        return ' '.join(parts), position
+
+
+def _write_array(file, values):
+    """Writes an array('I') to a file as little-endian uint32 values"""
+    if sys.byteorder == 'big':
+        values = array.array('I', values)
+        values.byteswap()
+    values.tofile(file)
+
+
+def _write_rule_names(file, rule_names):
+    """Writes the rule table: a uint32 count, then each name as a uint32 byte
+    length followed by its UTF-8 bytes"""
+    file.write(struct.pack('<I', len(rule_names)))
+    for name in rule_names:
+        data = name.encode('utf-8')
+        file.write(struct.pack('<I', len(data)) + data)
+
+
+def _read_uint32(file, path):
+    """Reads one little-endian uint32 of the header"""
+    data = file.read(4)
+    if len(data) != 4:
+        raise ValueError(f"{path} is truncated.")
+    return struct.unpack('<I', data)[0]
+
+
+def _read_header(file, path):
+    """Checks the MAGIC bytes and returns the rule table that follows them"""
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{path} is not a derivation file.")
+
+    rule_names = []
+    for x in range(_read_uint32(file, path)):
+        length = _read_uint32(file, path)
+        data = file.read(length)
+        if len(data) != length:
+            raise ValueError(f"{path} is truncated.")
+        rule_names.append(data.decode('utf-8'))
+    return rule_names
+
+
+def write_derivations(path, encoder, start_variable, count):
+    """Generates count derivations and streams them to a binary file. After the
+    MAGIC bytes comes the table of rule names that the rule ids refer to, then
+    every record is a uint32 length followed by that many uint32 values. Returns
+    the number of derivations written."""
+    written = 0
+    buffer = array.array('I')
+
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        _write_rule_names(file, encoder.rule_names)
+
+        for x in range(count):
+            encoding = encoder.derive(start_variable)
+            if encoding is None:
+                continue
+
+            buffer.append(len(encoding))
+            buffer.extend(encoding)
+            written += 1
+
+            if len(buffer) >= WRITE_BUFFER_SIZE:
+                _write_array(file, buffer)
+                buffer = array.array('I')
+
+        _write_array(file, buffer)
+
+    return written
+
+
+def read_rule_names(path):
+    """Returns the rule names, in rule id order, of a file made by write_derivations.
+    DerivationEncoder(grammar, read_rule_names(path)) decodes the file's derivations."""
+    with open(path, 'rb') as file:
+        return _read_header(file, path)
+
+
+def read_derivations(path, encoder = None):
+    """Yields the derivations stored in a file made by write_derivations, reading
+    the file in chunks. With an encoder, raises ValueError unless it numbers the
+    rules the way the file does. Raises ValueError if the file is cut off."""
+    with open(path, 'rb') as file:
+        rule_names = _read_header(file, path)
+        if encoder is not None and encoder.rule_names != rule_names:
+            raise ValueError(f"{path} numbers the rules differently from the encoder.")
+
+        values = array.array('I')
+        leftover = b''
+        while data := file.read(4 * READ_BUFFER_SIZE):
+            data = leftover + data
+            usable = len(data) - len(data) % 4
+            leftover = data[usable:]
+
+            chunk = array.array('I')
+            chunk.frombytes(data[:usable])
+            if sys.byteorder == 'big':
+                chunk.byteswap()
+            values.extend(chunk)
+
+            # Yields every whole record and keeps the start of the next one
+            position = 0
+            while position < len(values) and position + 1 + values[position] <= len(values):
+                length = values[position]
+                yield values[position + 1:position + 1 + length]
+                position += 1 + length
+            del values[:position]
+
+    if values or leftover:
+        raise ValueError(f"{path} is truncated.")
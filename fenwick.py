@@ -0,0 +1,111 @@
+class FenwickTree:
+    """Class for a Fenwick (binary indexed) tree over option weights. Changing a
+    weight, summing a prefix and finding where a running total is reached all
+    take O(log n) time.
+
+    Fractional changes leave rounding error in the internal sums, so the tree is
+    rebuilt from the exact weights after every size changes. A second tree counts
+    the positive weights exactly, so a pick that rounding moved onto a zero weight
+    can move to the closest positive weight in O(log n) time as well."""
+    def __init__(self, weights):
+        """Builds the tree from a list of weights in O(n) time"""
+        self.weights = list(weights)
+        self.size = len(self.weights)
+        self.top_step = 1 << (self.size.bit_length() - 1) if self.size else 0
+        self._build()
+
+    def _build(self):
+        """Recomputes every internal sum and count from the weights"""
+        self.tree = [0] + self.weights
+        self.counts = [0] + [int(weight > 0) for weight in self.weights]
+
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[i]
+                self.counts[parent] += self.counts[i]
+
+        self.positive_count = self._prefix(self.counts, self.size)
+        self.changes = 0
+
+    def set(self, index, weight):
+        """Changes the weight at index"""
+        if not 0 <= index < self.size:
+            raise IndexError(f"Index {index} is out of range.")
+
+        old = self.weights[index]
+        self.weights[index] = weight
+
+        self.changes += 1
+        if self.changes >= self.size:
+            self._build()
+            return
+
+        self._add(self.tree, index, weight - old)
+        count_delta = (weight > 0) - (old > 0)
+        if count_delta:
+            self._add(self.counts, index, count_delta)
+            self.positive_count += count_delta
+
+    def _add(self, tree, index, delta):
+        """Adds delta to the entry at index of one of the trees"""
+        i = index + 1
+        while i <= self.size:
+            tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, tree, count):
+        """Returns the total of the first count entries of one of the trees"""
+        total = 0
+        while count > 0:
+            total += tree[count]
+            count -= count & -count
+        return total
+
+    def _search(self, tree, value):
+        """Returns how many leading entries of one of the trees have a running
+        total below value, which is the index where value is first reached"""
+        position = 0
+        step = self.top_step
+
+        while step:
+            next_position = position + step
+            if next_position <= self.size and tree[next_position] < value:
+                position = next_position
+                value -= tree[next_position]
+            step >>= 1
+        return position
+
+    def prefix_sum(self, count):
+        """Returns the sum of the first count weights"""
+        return self._prefix(self.tree, count)
+
+    def total(self):
+        """Returns the sum of all the weights, which is exactly 0 when they all are"""
+        if self.positive_count == 0:
+            return 0
+        return max(self.prefix_sum(self.size), 0)
+
+    def find(self, value):
+        """Returns the first index with a positive weight whose running total is >=
+        value, which is the option the linear '<=' scan in Rule.choose_option
+        picks for a value of at most total(), or size if every weight is 0.
+        Rounding error can only move the pick onto a neighbouring zero weight or
+        past the end, so it moves to the closest positive weight instead."""
+        if self.positive_count == 0:
+            return self.size
+
+        position = self._search(self.tree, value)
+        if position == self.size:
+            return self._search(self.counts, self.positive_count)
+        if self.weights[position] <= 0:
+            return self._nearest_positive(position)
+        return position
+
+    def _nearest_positive(self, position):
+        """Returns the closest index with a positive weight to a zero weight,
+        searching forwards first. There must be at least one positive weight."""
+        before = self._prefix(self.counts, position)
+        if before < self.positive_count:
+            return self._search(self.counts, before + 1)
+        return self._search(self.counts, before)
@@ -0,0 +1,235 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+from option import Option
+from rule import Rule
+from symbols import TerminalSymbol, VariableSymbol
+
+
+# A line of this form outside of a { ... } block pulls in the rules of another
+# grammar file, whose path is relative to the file that includes it
+INCLUDE_DIRECTIVE = 'include'
+
+# Parsed files shared by every grammar loaded in this process, keyed by the
+# absolute path and stored with a hash of the contents they were parsed from
+_parsed_files = {}
+
+# Block offsets of the files indexed in this process, keyed by the absolute path
+# and stored with the size and modification time they were made from
+_file_indexes = {}
+
+# Suffix added to a grammar file's path to store its block index next to it
+INDEX_SUFFIX = '.index.json'
+
+
+def parse_symbol(text):
+    """Turns one word of an option line into a variable or terminal symbol"""
+    if text.startswith('[') and text.endswith(']'):
+        return VariableSymbol(text[1:-1])
+    return TerminalSymbol(text)
+
+
+def parse_option(line):
+    """Turns an option line such as '3 Boo is [Adjective]' into an Option"""
+    symbols = line.split()
+    weight = int(symbols[0])
+    return Option(weight, [parse_symbol(symbol) for symbol in symbols[1:]])
+
+
+def parse_entries(lines):
+    """Parses the lines of one grammar file into a list of entries, where each
+    entry is either a Rule or the path given to an include directive"""
+    entries = []
+
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+
+        if line == '{':
+            options = []
+
+            i += 1
+            variable_name = lines[i].strip()
+
+            i += 1
+            while lines[i].strip() != '}':
+                options.append(parse_option(lines[i]))
+                i += 1
+
+            entries.append(Rule(variable_name, options))
+        elif line.split(maxsplit = 1)[:1] == [INCLUDE_DIRECTIVE]:
+            entries.append(line[len(INCLUDE_DIRECTIVE):].strip())
+
+        i += 1
+
+    return entries
+
+
+def load_file(path):
+    """Returns the parsed entries of a single grammar file, parsing it only if
+    its content changed since it was last parsed in this process"""
+    path = os.path.abspath(path)
+
+    with open(path, 'rb') as file:
+        data = file.read()
+
+    digest = hashlib.blake2b(data, digest_size = 16).hexdigest()
+
+    if path not in _parsed_files or _parsed_files[path][0] != digest:
+        _parsed_files[path] = (digest, tuple(parse_entries(data.decode('utf-8').splitlines())))
+
+    return _parsed_files[path][1]
+
+
+def load_rules(path, loaded = None):
+    """Yields the rules of a grammar file in order, following its includes.
+    Every file is read at most once per call, which also breaks include cycles."""
+    path = os.path.abspath(path)
+
+    if loaded is None:
+        loaded = set()
+    if path in loaded:
+        return
+
+    loaded.add(path)
+
+    for entry in load_file(path):
+        if isinstance(entry, Rule):
+            yield entry
+        else:
+            yield from load_rules(os.path.join(os.path.dirname(path), entry), loaded)
+
+
+def _scan_file(path):
+    """Returns the entries of a grammar file without parsing its options, where
+    each entry is either [variable, start, end] with the byte offsets of its
+    { ... } block, or the path given to an include directive"""
+    entries = []
+    offset = 0
+    block_start = None
+    variable_name = None
+
+    with open(path, 'rb') as file:
+        for line in file:
+            stripped = line.strip()
+
+            if block_start is None:
+                if stripped == b'{':
+                    block_start = offset
+                elif stripped.split(maxsplit = 1)[:1] == [INCLUDE_DIRECTIVE.encode()]:
+                    entries.append(stripped[len(INCLUDE_DIRECTIVE):].strip().decode('utf-8'))
+            elif variable_name is None:
+                variable_name = stripped.decode('utf-8')
+            elif stripped == b'}':
+                entries.append([variable_name, block_start, offset + len(line)])
+                block_start = None
+                variable_name = None
+
+            offset += len(line)
+
+    return entries
+
+
+def _is_valid_entry(entry):
+    """Tells whether an entry read from a stored index has the right shape"""
+    if isinstance(entry, str):
+        return True
+    return (isinstance(entry, list) and len(entry) == 3 and isinstance(entry[0], str)
+            and all(isinstance(offset, int) for offset in entry[1:]))
+
+
+def _read_stored_index(index_path, stamp):
+    """Returns the entries stored in an index file for a grammar with the given
+    (size, mtime_ns), or None if the file is missing, stale or unreadable"""
+    try:
+        with open(index_path, 'r', encoding = 'utf-8') as stored_file:
+            stored = json.load(stored_file)
+        if [stored['size'], stored['mtime_ns']] != list(stamp):
+            return None
+        entries = stored['entries']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    if not isinstance(entries, list) or not all(_is_valid_entry(entry) for entry in entries):
+        return None
+    return entries
+
+
+def _write_stored_index(index_path, stamp, entries):
+    """Stores an index next to its grammar. It is written to a temporary file
+    that replaces the old one in a single step, so readers never see half of it."""
+    try:
+        descriptor, temporary_path = tempfile.mkstemp(dir = os.path.dirname(index_path), suffix = '.tmp')
+    except OSError:
+        return
+
+    try:
+        with os.fdopen(descriptor, 'w', encoding = 'utf-8') as stored_file:
+            json.dump({'size': stamp[0], 'mtime_ns': stamp[1], 'entries': entries}, stored_file)
+        os.replace(temporary_path, index_path)
+    except OSError:
+        with contextlib.suppress(OSError):
+            os.unlink(temporary_path)
+
+
+def index_file(path, persist = False):
+    """Returns the block entries of a single grammar file, scanning it only if it
+    changed since it was last indexed. With persist, the index is also kept in a
+    file next to the grammar so that other processes can skip the scan."""
+    path = os.path.abspath(path)
+    status = os.stat(path)
+    stamp = (status.st_size, status.st_mtime_ns)
+
+    if path in _file_indexes and _file_indexes[path][0] == stamp:
+        return _file_indexes[path][1]
+
+    index_path = path + INDEX_SUFFIX
+    entries = _read_stored_index(index_path, stamp) if persist else None
+
+    if entries is None:
+        entries = _scan_file(path)
+        if persist:
+            _write_stored_index(index_path, stamp, entries)
+
+    _file_indexes[path] = (stamp, entries)
+    return entries
+
+
+def build_index(path, persist = False, index = None, loaded = None):
+    """Returns a dictionary from each variable defined by a grammar file or its
+    includes to the (path, start, end) of its block, where later blocks win"""
+    path = os.path.abspath(path)
+
+    if index is None:
+        index = {}
+        loaded = set()
+    if path in loaded:
+        return index
+
+    loaded.add(path)
+
+    for entry in index_file(path, persist):
+        if isinstance(entry, str):
+            build_index(os.path.join(os.path.dirname(path), entry), persist, index, loaded)
+        else:
+            variable_name, start, end = entry
+            index[variable_name] = (path, start, end)
+
+    return index
+
+
+def load_block(path, start, end):
+    """Parses the single { ... } block found between two byte offsets of a file"""
+    with open(path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+
+    return parse_entries(data.decode('utf-8').splitlines())[0]
+
+
+def clear_cache():
+    """Forgets every parsed and indexed file so that the next load starts from scratch"""
+    _parsed_files.clear()
+    _file_indexes.clear()
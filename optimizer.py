@@ -0,0 +1,155 @@
+from option import Option
+from project4 import Grammar
+from rule import Rule
+from symbols import TerminalSymbol, VariableSymbol
+
+
+class OptimizationReport:
+    """Counts of what the optimizer changed and how much the grammar shrank"""
+    def __init__(self, before):
+        """Starts from the (rules, options, symbols) counts of the original grammar"""
+        self.before = before
+        self.after = before
+        self.fused_terminals = 0
+        self.inlined_variables = 0
+        self.merged_options = 0
+        self.merged_rules = 0
+
+    def __str__(self):
+        """Summarizes the report in a few lines"""
+        names = ('rules', 'options', 'symbols')
+        lines = [f"{name}: {old} -> {new}" for name, old, new in zip(names, self.before, self.after)]
+        lines.append(f"fused {self.fused_terminals} terminal(s), inlined {self.inlined_variables} "
+                     f"variable(s), merged {self.merged_options} option(s) and {self.merged_rules} rule(s)")
+        return '\n'.join(lines)
+
+
+def _size(rules):
+    """Returns the (rules, options, symbols) counts of distinct rules"""
+    distinct = {id(options): options for options in rules.values()}.values()
+    return (len(distinct),
+            sum(len(options) for options in distinct),
+            sum(len(symbols) for options in distinct for weight, symbols in options))
+
+
+def _symbol_key(symbol):
+    """Returns a hashable description of a symbol"""
+    if isinstance(symbol, VariableSymbol):
+        return ('variable', symbol.name)
+    return ('terminal', symbol.value)
+
+
+def _merge_options(options, report):
+    """Sums the weights of options with the same symbols, keeping the first one"""
+    merged = {}
+    for weight, symbols in options:
+        key = tuple(_symbol_key(symbol) for symbol in symbols)
+        if key in merged:
+            merged[key][0] += weight
+            report.merged_options += 1
+        else:
+            merged[key] = [weight, symbols]
+    return list(merged.values())
+
+
+def _fuse_terminals(symbols, report):
+    """Joins runs of adjacent terminals into single terminals. This is safe because
+    an option joins its symbols with single spaces either way."""
+    fused = []
+    for symbol in symbols:
+        if isinstance(symbol, TerminalSymbol) and fused and isinstance(fused[-1], TerminalSymbol):
+            fused[-1] = TerminalSymbol(fused[-1].value + ' ' + symbol.value)
+            report.fused_terminals += 1
+        else:
+            fused.append(symbol)
+    return fused
+
+
+def _trivial_rules(rules):
+    """Returns the symbols of rules that always expand the same way, by name.
+    Options without symbols are left alone, since an empty option still adds a
+    space where it is used."""
+    return {name: options[0][1] for name, options in rules.items()
+            if len(options) == 1 and options[0][0] > 0 and options[0][1]}
+
+
+def _inline(symbols, trivial, expanding, report):
+    """Replaces variables of trivial rules with their symbols, skipping any rule
+    that is already being expanded so recursive rules are never inlined forever"""
+    inlined = []
+    for symbol in symbols:
+        if isinstance(symbol, VariableSymbol) and symbol.name in trivial and symbol.name not in expanding:
+            inlined.extend(_inline(trivial[symbol.name], trivial, expanding | {symbol.name}, report))
+            report.inlined_variables += 1
+        else:
+            inlined.append(symbol)
+    return inlined
+
+
+def _merge_rules(rules, report):
+    """Points every rule whose options are identical to an earlier rule's at that
+    rule, repeating while redirected variables make more rules identical"""
+    canonical = {}
+
+    while True:
+        seen = {}
+        renamed = {}
+        for name, options in rules.items():
+            if name in canonical:
+                continue
+            key = tuple((weight, tuple(_symbol_key(symbol) for symbol in symbols))
+                        for weight, symbols in options)
+            if key in seen:
+                renamed[name] = seen[key]
+            else:
+                seen[key] = name
+
+        if not renamed:
+            # A rule merged into one that was merged again later follows the chain
+            for name in canonical:
+                while canonical[name] in canonical:
+                    canonical[name] = canonical[canonical[name]]
+                rules[name] = rules[canonical[name]]
+            return canonical
+
+        report.merged_rules += len(renamed)
+        canonical.update(renamed)
+        for name, options in rules.items():
+            if name not in canonical:
+                for option in options:
+                    option[1] = [VariableSymbol(renamed.get(symbol.name, symbol.name))
+                                 if isinstance(symbol, VariableSymbol) else symbol
+                                 for symbol in option[1]]
+
+
+def optimize(grammar):
+    """Returns an optimized copy of the grammar and an OptimizationReport. The copy
+    gives every sentence exactly the same probability as the original, although
+    it draws random numbers differently. The original grammar is not changed.
+    Only the rules already in grammar.rules are optimized."""
+    rules = {name: [[option.weight, list(option.symbols)] for option in rule.options]
+             for name, rule in grammar.rules.items()}
+    report = OptimizationReport(_size(rules))
+
+    for name in rules:
+        rules[name] = _merge_options(
+            [[weight, _fuse_terminals(symbols, report)] for weight, symbols in rules[name]], report)
+
+    trivial = _trivial_rules(rules)
+    for name in rules:
+        rules[name] = _merge_options(
+            [[weight, _fuse_terminals(_inline(symbols, trivial, {name}, report), report)]
+             for weight, symbols in rules[name]], report)
+
+    canonical = _merge_rules(rules, report)
+    report.after = _size(rules)
+
+    optimized = Grammar()
+    built = {}
+    for name, options in rules.items():
+        target = canonical.get(name, name)
+        if target not in built:
+            built[target] = Rule(target, [Option(weight, symbols) for weight, symbols in options])
+        optimized.rules[name] = built[target]
+
+    return optimized, report
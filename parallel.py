@@ -0,0 +1,51 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from random_access import generate_range
+
+
+# Number of sentences generated by each task handed to the thread pool
+DEFAULT_CHUNK_SIZE = 1000
+
+
+class ThreadLocalRandom(threading.local):
+    """A stand-in for the random module that gives every thread its own
+    generator, so threads never contend on shared random state"""
+    def __init__(self):
+        """Runs once in every thread that uses this object"""
+        self.generator = random.Random()
+
+    def __getattr__(self, name):
+        """Forwards uniform(), random() and the rest to this thread's generator"""
+        return getattr(self.generator, name)
+
+
+def _generate_chunk(grammar, start_variable, first, stop, seed):
+    """Generates sentences first to stop from a frozen grammar. With a seed they
+    come from random_access, otherwise from a private unseeded generator."""
+    if seed is not None:
+        return list(generate_range(grammar, start_variable, seed, first, stop))
+    view = grammar.with_random(random.Random())
+    return [view.output_sentence(start_variable) for x in range(first, stop)]
+
+
+def generate_parallel(grammar, start_variable, count, workers = None, seed = None,
+                      chunk_size = DEFAULT_CHUNK_SIZE):
+    """Generates count sentences on a pool of threads and returns them in order.
+    The grammar is frozen first if it is not already. With a seed, the output
+    is the same as random_access.generate_range(grammar, start_variable, seed,
+    0, count), whatever the number of workers or the chunk size."""
+    if not grammar.frozen:
+        grammar.freeze()
+
+    with ThreadPoolExecutor(max_workers = workers) as executor:
+        futures = [
+            executor.submit(
+                _generate_chunk, grammar, start_variable, first, min(first + chunk_size, count), seed)
+            for first in range(0, count, chunk_size)]
+
+        sentences = []
+        for future in futures:
+            sentences.extend(future.result())
+
+    return sentences
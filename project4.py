@@ -2,22 +2,46 @@
 #
 # ICS 33 Spring 2024
 # Project 4: Still Looking for Something
+import copy
 import random
-from option import Option
+from grammar_loader import build_index, load_block, load_rules
+from parallel import ThreadLocalRandom
 from rule import Rule
-from symbols import TerminalSymbol, VariableSymbol
+from symbols import VariableSymbol
 
 
 class Grammar:
     """Class for Grammar"""
     def __init__(self):
-        """Stores the rules in a dictionary"""
+        """Stores the rules in a dictionary and the source of randomness"""
         self.rules = {}
+        self.random = random
+        self.frozen = False
 
     def add_rule(self, rule):
         """Function for adding rules"""
+        if self.frozen:
+            raise RuntimeError(f"Cannot add rule {rule.variable} to a frozen grammar.")
         self.rules[rule.variable] = rule
 
+    def freeze(self):
+        """Makes the grammar read-only so it can be shared between threads. Every
+        rule precomputes its weights and each thread draws from its own generator."""
+        for rule in self.rules.values():
+            rule.freeze()
+        self.random = ThreadLocalRandom()
+        self.frozen = True
+        return self
+
+    def with_random(self, generator):
+        """Returns a view of a frozen grammar that shares its rules but draws from
+        the given random.Random instead"""
+        if not self.frozen:
+            raise RuntimeError("Only a frozen grammar can be shared between generators.")
+        view = copy.copy(self)
+        view.random = generator
+        return view
+
     def get_rule(self, variable):
         """Function for returning a single rule"""
         try:
@@ -26,6 +50,14 @@ class Grammar:
         except KeyError as e:
             print(f"{e}. Could not find rule for {variable}.")
 
+    def has_rule(self, variable):
+        """Tells whether the grammar defines a variable"""
+        return variable in self.rules
+
+    def rule_names(self):
+        """Returns the names of every rule the grammar defines"""
+        return list(self.rules)
+
     def output_sentence(self, start_variable):
         """Returns a sentence given a start variable"""
         rule_instance = self.get_rule(start_variable)
@@ -33,49 +65,70 @@ class Grammar:
         return sentence
 
 
+class LazyGrammar(Grammar):
+    """A grammar that indexes the blocks of its file and only parses a block the
+    first time get_rule asks for its variable"""
+    def __init__(self, path, persist_index = False):
+        """Builds (or reuses) the block index of the file and its includes"""
+        super().__init__()
+        self.index = build_index(path, persist_index)
+        self.reachable_loaded = False
+
+    def get_rule(self, variable):
+        """Function for returning a single rule, parsing it if needed"""
+        if variable not in self.rules and variable in self.index and not self.frozen:
+            self.add_rule(load_block(*self.index[variable]))
+        return super().get_rule(variable)
+
+    def has_rule(self, variable):
+        """Tells whether the grammar defines a variable, whether or not its block
+        has been parsed yet"""
+        return variable in self.rules or (variable in self.index and not self.frozen)
+
+    def rule_names(self):
+        """Returns the names of every rule, in the order of the files, including
+        rules whose blocks have not been parsed yet"""
+        names = [name for name in self.index if self.has_rule(name)]
+        names.extend(name for name in self.rules if name not in self.index)
+        return names
+
+    def freeze(self):
+        """Makes the grammar read-only. A frozen grammar cannot parse blocks any more,
+        so every indexed block is parsed first unless load_reachable has already
+        loaded the rules that will be used."""
+        if not self.reachable_loaded and not self.frozen:
+            for variable in self.index:
+                self.get_rule(variable)
+        return super().freeze()
+
+    def load_reachable(self, start_variable):
+        """Parses every block reachable from the start variable up front, which is
+        needed before the grammar is frozen or its rules are walked directly"""
+        pending = [start_variable]
+        seen = set()
+
+        while pending:
+            variable = pending.pop()
+            if variable in seen or variable not in self.index:
+                continue
+
+            seen.add(variable)
+            for option in self.get_rule(variable).options:
+                pending.extend(symbol.name for symbol in option.symbols
+                               if isinstance(symbol, VariableSymbol))
+
+        self.reachable_loaded = True
+        return self
+
+
 def grammar_parser(path):
-    """Parsing function that reads the file then iterate over the lines"""
+    """Builds a grammar from a file and the files it includes. The parsed rules
+    are cached by grammar_loader, so shared files are only parsed once."""
     grammar = Grammar()
 
-    with open(path, 'r') as file:
-        lines = file.readlines()
-
-    i = 0
-    while i < len(lines):
-        line = lines[i].strip()
-
-        if line == '{':
-            options = []
-
-            i += 1
-            variable_name = lines[i].strip()
-
-            i += 1
-            while lines[i].strip() != '}':
-                line = lines[i].strip()
-                symbols = line.split()
-                weight = int(symbols[0])
-
-                symbol_list = []
-                for symbol in symbols[1:]:
-                    if symbol.startswith('[') and symbol.endswith(']'):
-                        # Store the symbol in corresponding class
-                        clean_symbol = symbol[1:-1]
-                        symbol = VariableSymbol(clean_symbol)
-                    else:
-                        symbol = TerminalSymbol(symbol)
-                    # Append the symbol to our list of symbols
-                    symbol_list.append(symbol)
-                # Lastly now that we have our weight + symbols, we can store it in Option class
-                option = Option(weight, symbol_list)
-                options.append(option)
-
-                i += 1  # Continue iteration
-            # Add the rule to Rule class
-            rule = Rule(variable_name, options)
-            grammar.add_rule(rule)
-
-        i += 1
+    for rule in load_rules(path):
+        # Each grammar gets its own Rule around the shared, cached options
+        grammar.add_rule(Rule(rule.variable, rule.options))
 
     return grammar
 
@@ -38,7 +38,6 @@ import subprocess
 import sys
 import tempfile
 import threading
-import time
 import traceback
 
 
@@ -53,9 +52,6 @@ class TextProcessReadTimeout(Exception):
 
 
 class TextProcess:
-    _READ_INTERVAL_IN_SECONDS = 0.025
-
-
     def __init__(self, args: [str], working_directory: str):
         self._process = subprocess.Popen(
             args, cwd = working_directory, bufsize = 0,
@@ -97,34 +93,28 @@ class TextProcess:
 
     def read_line(self, timeout: float = None) -> tuple[str, bool] or None:
         self._stdout_read_trigger.put('read')
-        
-        sleep_time = 0
-        
-        while timeout is None or sleep_time < timeout:
-            try:
-                next_result = self._stdout_buffer.get_nowait()
-
-                if next_result is None:
-                    return None
-                elif isinstance(next_result, Exception):
-                    raise next_result
-                else:
-                    line = next_result.decode(locale.getpreferredencoding(False))
-                    had_newline = False
-
-                    if line.endswith('\r\n'):
-                        line = line[:-2]
-                        had_newline = True
-                    elif line.endswith('\n'):
-                        line = line[:-1]
-                        had_newline = True
-
-                    return line, had_newline
-            except queue.Empty:
-                time.sleep(TextProcess._READ_INTERVAL_IN_SECONDS)
-                sleep_time += TextProcess._READ_INTERVAL_IN_SECONDS
-
-        raise TextProcessReadTimeout()
+
+        try:
+            next_result = self._stdout_buffer.get(timeout = timeout)
+        except queue.Empty:
+            raise TextProcessReadTimeout()
+
+        if next_result is None:
+            return None
+        elif isinstance(next_result, Exception):
+            raise next_result
+        else:
+            line = next_result.decode(locale.getpreferredencoding(False))
+            had_newline = False
+
+            if line.endswith('\r\n'):
+                line = line[:-2]
+                had_newline = True
+            elif line.endswith('\n'):
+                line = line[:-1]
+                had_newline = True
+
+            return line, had_newline
 
 
     def _stdout_read_loop(self):
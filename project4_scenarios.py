@@ -0,0 +1,222 @@
+# project4_scenarios.py
+#
+# ICS 33 Spring 2024
+# Project 4: Still Looking for Something
+#
+# A regression harness that runs many grammar scenarios at once.  Each scenario
+# gives a grammar, the number of sentences, the start variable, an optional
+# random seed and the exact lines of output expected from "project4.py".
+#
+# By default every scenario runs "project4.py" in its own interpreter, with a
+# pool of threads each waiting on one subprocess.  With --in-process, a pool of
+# worker processes imports project4 once and calls project4.main() for every
+# scenario it is given, which skips the interpreter startup of each run.
+#
+# Usage:
+#
+#     python project4_scenarios.py [scenarios.json] [--workers N] [--in-process]
+#
+# The JSON file holds a list of objects with the keys "name", "grammar" (the
+# text of a grammar file), "count", "start", "expected" (a list of lines) and
+# optionally "seed".  Without a file, the sanity checker's scenario is run.
+
+import argparse
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
+import io
+import json
+import os
+from pathlib import Path
+import random
+import subprocess
+import sys
+import tempfile
+
+from project4_sanitycheck import print_labeled_output
+
+
+
+# Longest time, in seconds, that a single scenario may run in a subprocess.
+_TIMEOUT_IN_SECONDS = 10.0
+
+# Runs project4.main() in a fresh interpreter, seeding random first when a
+# seed is passed as the only argument.
+_SUBPROCESS_RUNNER = (
+    'import random, sys\n'
+    'if len(sys.argv) > 1: random.seed(int(sys.argv[1]))\n'
+    'import project4\n'
+    'project4.main()\n')
+
+
+
+class Scenario:
+    def __init__(
+            self, name: str, grammar: str, count: int, start: str,
+            expected: Sequence[str], seed: int | None = None):
+        self.name = name
+        self.grammar = grammar
+        self.count = count
+        self.start = start
+        self.expected = list(expected)
+        self.seed = seed
+
+
+    def make_input(self, grammar_path: Path) -> str:
+        return f'{grammar_path}\n{self.count}\n{self.start}\n'
+
+
+
+class ScenarioResult:
+    def __init__(self, scenario: Scenario, output: str, error: str | None = None):
+        self.scenario = scenario
+        self.output = output
+        self.error = error
+
+
+    @property
+    def passed(self) -> bool:
+        return (self.error is None
+                and self.output.splitlines() == self.scenario.expected
+                and (self.output.endswith('\n') or not self.scenario.expected))
+
+
+
+def load_scenarios(path: Path) -> list[Scenario]:
+    with open(path, 'r', encoding = 'utf-8') as scenario_file:
+        return [
+            Scenario(
+                item['name'], item['grammar'], item['count'], item['start'],
+                item['expected'], item.get('seed'))
+            for item in json.load(scenario_file)]
+
+
+
+def default_scenarios() -> list[Scenario]:
+    return [
+        Scenario(
+            'sanity check',
+            '{\nHowIsBoo\n1 Boo is [Adjective] today\n}\n\n{\nAdjective\n100 perfect\n}\n',
+            5, 'HowIsBoo', ['Boo is perfect today'] * 5)
+    ]
+
+
+
+@contextlib.contextmanager
+def _grammar_file(scenario: Scenario):
+    with tempfile.NamedTemporaryFile(
+            mode = 'w', encoding = 'utf-8', suffix = '.txt', delete = False) as grammar_file:
+        grammar_file.write(scenario.grammar)
+
+    try:
+        yield Path(grammar_file.name)
+    finally:
+        Path(grammar_file.name).unlink(missing_ok = True)
+
+
+
+def run_in_subprocess(scenario: Scenario, working_directory: Path) -> ScenarioResult:
+    args = [sys.executable, '-c', _SUBPROCESS_RUNNER]
+
+    if scenario.seed is not None:
+        args.append(str(scenario.seed))
+
+    with _grammar_file(scenario) as grammar_path:
+        try:
+            # communicate() waits on the pipes with blocking reads, never polling
+            result = subprocess.run(
+                args, cwd = working_directory, input = scenario.make_input(grammar_path),
+                stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+                encoding = 'utf-8', timeout = _TIMEOUT_IN_SECONDS)
+        except subprocess.TimeoutExpired as e:
+            return ScenarioResult(
+                scenario, e.stdout or '',
+                f'Timed out after {_TIMEOUT_IN_SECONDS} second(s)')
+
+    if result.returncode != 0:
+        return ScenarioResult(scenario, result.stdout, f'Exited with code {result.returncode}')
+
+    return ScenarioResult(scenario, result.stdout)
+
+
+
+def run_in_process(scenario: Scenario) -> ScenarioResult:
+    import project4
+
+    output = io.StringIO()
+
+    with _grammar_file(scenario) as grammar_path:
+        if scenario.seed is not None:
+            random.seed(scenario.seed)
+
+        stdin = sys.stdin
+        sys.stdin = io.StringIO(scenario.make_input(grammar_path))
+
+        try:
+            with contextlib.redirect_stdout(output):
+                project4.main()
+        except Exception as e:
+            return ScenarioResult(scenario, output.getvalue(), f'{type(e).__name__}: {e}')
+        finally:
+            sys.stdin = stdin
+
+    return ScenarioResult(scenario, output.getvalue())
+
+
+
+def run_scenarios(
+        scenarios: Sequence[Scenario], *, workers: int | None = None,
+        in_process: bool = False) -> list[ScenarioResult]:
+    if in_process:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            return list(executor.map(run_in_process, scenarios))
+    else:
+        working_directory = Path(__file__).parent
+
+        with ThreadPoolExecutor(max_workers = workers or os.cpu_count()) as executor:
+            return list(executor.map(
+                lambda scenario: run_in_subprocess(scenario, working_directory), scenarios))
+
+
+
+def report(results: Sequence[ScenarioResult]) -> bool:
+    failures = [result for result in results if not result.passed]
+
+    for result in failures:
+        print_labeled_output('FAILED', result.scenario.name)
+
+        if result.error is not None:
+            print_labeled_output('ERROR', result.error)
+
+        print_labeled_output('EXPECTED', *result.scenario.expected)
+        print_labeled_output('OUTPUT', *result.output.splitlines())
+
+    print_labeled_output(
+        'PASSED' if not failures else 'FAILED',
+        f'{len(results) - len(failures)} of {len(results)} scenario(s) passed.')
+
+    return not failures
+
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = 'Runs many Project 4 scenarios at once.')
+    parser.add_argument('scenarios', nargs = '?', type = Path)
+    parser.add_argument('--workers', type = int, default = None)
+    parser.add_argument('--in-process', action = 'store_true')
+    args = parser.parse_args()
+
+    if args.scenarios is None:
+        scenarios = default_scenarios()
+    else:
+        scenarios = load_scenarios(args.scenarios)
+
+    results = run_scenarios(scenarios, workers = args.workers, in_process = args.in_process)
+
+    if not report(results):
+        sys.exit(1)
+
+
+
+if __name__ == '__main__':
+    main()
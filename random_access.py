@@ -0,0 +1,90 @@
+# Sentences are numbered within 64-bit counters
+_MASK = (1 << 64) - 1
+
+# The SplitMix64 increment, the golden ratio as a 64-bit fraction
+_GAMMA = 0x9E3779B97F4A7C15
+
+# Scales the top 53 bits of a 64-bit value into [0, 1)
+_FLOAT_SCALE = 2.0 ** -53
+
+
+def _mix(value):
+    """Scrambles a 64-bit integer with the SplitMix64 finalizer"""
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK
+    return value ^ (value >> 31)
+
+
+def splitmix64(value):
+    """Returns the first SplitMix64 output for a 64-bit state"""
+    return _mix((value + _GAMMA) & _MASK)
+
+
+class SplitMixRandom:
+    """A small SplitMix64 generator with the random() and uniform() of
+    random.Random. Starting the stream of a sentence only sets one integer, so
+    it costs far less than seeding a Mersenne Twister for every sentence."""
+    def __init__(self, seed, index = 0):
+        """Starts the stream of sentence number index of a seed"""
+        self.seed = splitmix64(seed & _MASK)
+        self.start(index)
+
+    def start(self, index):
+        """Moves to the start of the stream of sentence number index"""
+        self.state = self.seed ^ (index & _MASK)
+
+    def random(self):
+        """Returns the next float in [0, 1)"""
+        self.state = (self.state + _GAMMA) & _MASK
+        return (_mix(self.state) >> 11) * _FLOAT_SCALE
+
+    def uniform(self, a, b):
+        """Returns a float between a and b, like random.Random.uniform"""
+        return a + (b - a) * self.random()
+
+
+def sentence_random(seed, index):
+    """Returns the generator for sentence number index of a seeded corpus. It only
+    depends on (seed, index), so any sentence can be made without the others."""
+    return SplitMixRandom(seed, index)
+
+
+def sentence_at(grammar, start_variable, seed, index):
+    """Returns sentence number index of the corpus for a seed. The grammar is
+    frozen first if it is not already."""
+    if not grammar.frozen:
+        grammar.freeze()
+    return grammar.with_random(sentence_random(seed, index)).output_sentence(start_variable)
+
+
+def generate_range(grammar, start_variable, seed, first, stop):
+    """Yields sentences first up to (but not including) stop of the corpus for a
+    seed, in O(stop - first) time. One view of the grammar is used for the whole
+    range, and its generator moves to each sentence's stream in turn."""
+    if not grammar.frozen:
+        grammar.freeze()
+    generator = SplitMixRandom(seed, first)
+    view = grammar.with_random(generator)
+    for index in range(first, stop):
+        generator.start(index)
+        yield view.output_sentence(start_variable)
+
+
+def shard_range(count, shard, shards):
+    """Returns the (first, stop) sentences of shard number shard out of shards,
+    which together cover 0 to count in order"""
+    if not 0 <= shard < shards:
+        raise ValueError(f"Shard {shard} does not exist out of {shards}.")
+    return count * shard // shards, count * (shard + 1) // shards
+
+
+def parse_shard(text):
+    """Turns 'k/n' into (k, n)"""
+    shard, shards = text.split('/')
+    return int(shard), int(shards)
+
+
+def parse_range(text):
+    """Turns 'a:b' into (a, b)"""
+    first, stop = text.split(':')
+    return int(first), int(stop)
@@ -1,4 +1,8 @@
-import random
+import bisect
+import math
+from itertools import accumulate
+from fenwick import FenwickTree
+from option import Option
 
 
 class Rule:
@@ -7,21 +11,72 @@ class Rule:
         """Stores the variable and options"""
         self.variable = variable
         self.options = options
+        self.cumulative_weights = None
+        self.weight_tree = None
+
+    def freeze(self):
+        """Precomputes the running totals of the option weights, so choosing an
+        option afterwards only reads shared state and never writes it"""
+        self.cumulative_weights = tuple(accumulate(option.weight for option in self.options))
+
+    def set_weight(self, index, weight):
+        """Changes the weight of one option, which may be fractional, in O(log n).
+        The first change builds a Fenwick tree that later picks are made from."""
+        if self.cumulative_weights is not None:
+            raise RuntimeError(f"Cannot change the weights of frozen rule {self.variable}.")
+        if not 0 <= index < len(self.options):
+            raise IndexError(f"Rule {self.variable} has no option {index}.")
+        if not math.isfinite(weight) or weight < 0:
+            raise ValueError(f"Weight {weight} is not a finite, non-negative number.")
+
+        if self.weight_tree is None:
+            # Copy the list so options shared with other grammars stay unchanged
+            self.options = list(self.options)
+            self.weight_tree = FenwickTree([option.weight for option in self.options])
+
+        self.options[index] = Option(weight, self.options[index].symbols)
+        self.weight_tree.set(index, weight)
+
+    def choose_option(self, grammar):
+        """Returns the index of an option picked according to the weights, or None
+        if no option could be chosen"""
+        if self.cumulative_weights is not None:
+            sum_weight = self.cumulative_weights[-1] if self.cumulative_weights else 0
+        elif self.weight_tree is not None:
+            sum_weight = self.weight_tree.total()
+        else:
+            sum_weight = sum(option.weight for option in self.options)
 
-    def generate_rule(self, grammar):
-        """Generates a sentence based on the rule"""
-        sum_weight = sum(option.weight for option in self.options)
         if sum_weight == 0:
             print("Error. Weight sum is 0.")
             return None
 
-        chosen_option = random.uniform(0, sum_weight)
-        current_weight = 0
-        for option in self.options:
-            current_weight += option.weight
-            if chosen_option <= current_weight:
-                sentence = option.generate_option(grammar)
-                return sentence
+        chosen_option = grammar.random.uniform(0, sum_weight)
+
+        if self.cumulative_weights is not None:
+            # Same as the scan below: the first option whose running total is >= the pick
+            index = bisect.bisect_left(self.cumulative_weights, chosen_option)
+            if index < len(self.options):
+                return index
+        elif self.weight_tree is not None:
+            index = self.weight_tree.find(chosen_option)
+            if index < len(self.options):
+                return index
+        else:
+            current_weight = 0
+            for index, option in enumerate(self.options):
+                current_weight += option.weight
+                if chosen_option <= current_weight:
+                    return index
 
         print("Error. No option chosen.")
         return None
+
+    def generate_rule(self, grammar):
+        """Generates a sentence based on the rule"""
+        index = self.choose_option(grammar)
+        if index is None:
+            return None
+
+        sentence = self.options[index].generate_option(grammar)
+        return sentence
@@ -0,0 +1,125 @@
+import bz2
+import contextlib
+import functools
+import gzip
+import lzma
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+
+
+# How each kind of compression opens a file for writing text
+_OPENERS = {
+    'gzip': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open,
+    'lzma': functools.partial(lzma.open, format = lzma.FORMAT_ALONE),
+}
+
+# The compression picked for each file extension
+_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.lzma': 'lzma'}
+
+# Default number of batches that may wait in the queue for the writer
+DEFAULT_QUEUE_SIZE = 8
+
+# Seconds a producer waits on a full queue before checking the writer again
+POLL_INTERVAL = 0.1
+
+
+def compression_for(path):
+    """Returns the compression that matches the extension of a path, or None"""
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def open_sink(path, compression = 'auto'):
+    """Opens a text file for writing, compressed with 'gzip', 'bz2', 'xz' or
+    'lzma', or not at all with None. 'auto' goes by the file extension, and a
+    path of None or '-' writes to standard output."""
+    if path is None or path == '-':
+        return contextlib.nullcontext(sys.stdout)
+    if compression == 'auto':
+        compression = compression_for(path)
+    if compression is None:
+        return open(path, 'w', encoding = 'utf-8')
+    if compression not in _OPENERS:
+        raise ValueError(f"Unknown compression {compression}.")
+    return _OPENERS[compression](path, 'wt', encoding = 'utf-8')
+
+
+def _write_batches(path, compression, batches):
+    """Writes every batch of sentences from the queue until it gets None"""
+    with open_sink(path, compression) as sink:
+        while (batch := batches.get()) is not None:
+            if batch:
+                sink.write('\n'.join(batch) + '\n')
+
+
+class BackgroundWriter:
+    """Writes batches of sentences to a sink on another thread, or on another
+    process with use_process, so compression overlaps with generation. The queue
+    holds at most queue_size batches, so a generator that gets ahead of the
+    compressor waits instead of using more memory. If the writer fails, the
+    next write_batch or close raises its error."""
+    def __init__(self, path, compression = 'auto', queue_size = DEFAULT_QUEUE_SIZE, use_process = False):
+        """Starts the writer"""
+        self.error = None
+
+        if use_process:
+            if path is None or path == '-':
+                raise ValueError("A writer process needs a file to write to.")
+            self._batches = multiprocessing.Queue(queue_size)
+            self._worker = multiprocessing.Process(
+                target = _write_batches, args = (path, compression, self._batches), daemon = True)
+        else:
+            self._batches = queue.Queue(queue_size)
+            self._worker = threading.Thread(target = self._run, args = (path, compression), daemon = True)
+
+        self._worker.start()
+
+    def _run(self, path, compression):
+        """Runs the writer thread and keeps any error for the producer to raise"""
+        try:
+            _write_batches(path, compression, self._batches)
+        except Exception as e:
+            self.error = e
+
+    def _check(self):
+        """Raises the error of a writer that has stopped by failing"""
+        if self.error is not None:
+            raise self.error
+        if isinstance(self._worker, multiprocessing.Process) and self._worker.exitcode not in (None, 0):
+            raise RuntimeError(f"The writer process exited with code {self._worker.exitcode}.")
+
+    def _put(self, item):
+        """Puts an item in the queue, checking the writer while the queue is full"""
+        while True:
+            self._check()
+            try:
+                self._batches.put(item, timeout = POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    def write_batch(self, sentences):
+        """Hands a list of sentences to the writer, waiting while the queue is full.
+        Raises right away if the writer has failed."""
+        self._put(list(sentences))
+
+    def close(self):
+        """Waits for every batch to be written, then raises any error the writer hit"""
+        self._put(None)
+        self._worker.join()
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except Exception:
+            # An error of the body is more useful than the writer failing after it
+            if exc_type is None:
+                raise
@@ -7,7 +7,7 @@ class TestDoubleInput:
     def read(self):
         """Reads through lines"""
         try:
-            return next(self.input)
+            return next(self.inputs)
         except StopIteration:
             return ''
 
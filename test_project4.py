@@ -1,9 +1,34 @@
+import bz2
+import gzip
+import lzma
+import array
+import os
+import random
+from fractions import Fraction
+import tempfile
+import threading
 import unittest
-from project4 import Grammar, grammar_parser, main
+import corpus
+import derivation
+import grammar_loader
+from conformance import (ENGINES, Engine, ReferenceEngine, UpdateEngine, check_option_frequencies,
+                         check_seed_equality, chi_square_sf, make_synthetic_grammar, run_conformance)
+from constraints import constrained_sampler
+from fenwick import FenwickTree
+from derivation import DerivationEncoder, read_derivations, read_rule_names, write_derivations
+from optimizer import optimize
+from random_access import SplitMixRandom, generate_range, sentence_at, shard_range, splitmix64
+from parallel import generate_parallel
+from project4_scenarios import Scenario, run_scenarios
+from sinks import BackgroundWriter
+from vocabulary import TokenCorpus, Vocabulary, generate_tokens, write_token_corpus
+from corpus import generate_corpus
+from project4 import Grammar, LazyGrammar, grammar_parser, main
 from rule import Rule
 from option import Option
 from symbols import TerminalSymbol, VariableSymbol
 from test_double import TestDoubleInput, TestDoubleOutput
+from unittest import mock
 
 
 class TestGrammar(unittest.TestCase):
@@ -41,18 +66,662 @@ class TestGrammar(unittest.TestCase):
         self.assertIn("Adjective", grammar.rules)
 
 
+class GrammarFileTestCase(unittest.TestCase):
+    """Base class for tests that write grammar files to a temporary directory"""
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        grammar_loader.clear_cache()
+
+    def tearDown(self):
+        self.directory.cleanup()
+        grammar_loader.clear_cache()
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as file:
+            file.write(text)
+        return path
+
+
+class TestGrammarLoader(GrammarFileTestCase):
+    """Test class for includes and caching in grammar_loader.py"""
+    def test_include(self):
+        """Tests that included rules are added to the grammar"""
+        self.write('lexicon.txt', '{\nAdjective\n1 happy\n}\n')
+        path = self.write('main.txt', 'include lexicon.txt\n\n{\nStart\n1 Boo is [Adjective]\n}\n')
+        grammar = grammar_parser(path)
+        self.assertEqual(grammar.output_sentence("Start"), "Boo is happy")
+
+    def test_include_cycle(self):
+        """Tests that files including each other are only loaded once"""
+        first = self.write('first.txt', 'include second.txt\n{\nA\n1 a\n}\n')
+        self.write('second.txt', 'include first.txt\n{\nB\n1 b\n}\n')
+        grammar = grammar_parser(first)
+        self.assertEqual(set(grammar.rules), {"A", "B"})
+
+    def test_shared_file_parsed_once(self):
+        """Tests that a file shared by two grammars is parsed once"""
+        self.write('lexicon.txt', '{\nNoun\n1 cat\n}\n')
+        first = self.write('first.txt', 'include lexicon.txt\n{\nA\n1 [Noun]\n}\n')
+        second = self.write('second.txt', 'include lexicon.txt\n{\nB\n1 [Noun]\n}\n')
+        first_grammar = grammar_parser(first)
+        second_grammar = grammar_parser(second)
+        self.assertEqual(len(grammar_loader._parsed_files), 3)
+        self.assertIs(first_grammar.rules["Noun"].options, second_grammar.rules["Noun"].options)
+        self.assertIsNot(first_grammar.rules["Noun"], second_grammar.rules["Noun"])
+
+    def test_changed_file_reparsed(self):
+        """Tests that editing a file invalidates its cached rules"""
+        path = self.write('grammar.txt', '{\nA\n1 old\n}\n')
+        self.assertEqual(grammar_parser(path).output_sentence("A"), "old")
+        self.write('grammar.txt', '{\nA\n1 new\n}\n')
+        self.assertEqual(grammar_parser(path).output_sentence("A"), "new")
+        self.assertEqual(len(grammar_loader._parsed_files), 1)
+
+
+class TestLazyGrammar(GrammarFileTestCase):
+    """Test class for LazyGrammar and the block index in grammar_loader.py"""
+    def test_only_reachable_rules_parsed(self):
+        """Tests that rules are parsed when generation first reaches them"""
+        path = self.write('grammar.txt', '{\nStart\n1 Boo is [Adjective]\n}\n\n'
+                                         '{\nAdjective\n1 happy\n}\n\n{\nUnused\n1 never\n}\n')
+        grammar = LazyGrammar(path)
+        self.assertEqual(set(grammar.index), {"Start", "Adjective", "Unused"})
+        self.assertEqual(grammar.rules, {})
+        self.assertEqual(grammar.output_sentence("Start"), "Boo is happy")
+        self.assertEqual(set(grammar.rules), {"Start", "Adjective"})
+
+    def test_include_and_load_reachable(self):
+        """Tests that indexed includes can be loaded up front and then frozen"""
+        self.write('lexicon.txt', '{\r\nAdjective\r\n1 happy\r\n}\r\n{\r\nNoun\r\n1 cat\r\n}\r\n')
+        path = self.write('main.txt', 'include lexicon.txt\n{\nStart\n1 [Adjective]\n}\n')
+        grammar = LazyGrammar(path).load_reachable("Start").freeze()
+        self.assertEqual(set(grammar.rules), {"Start", "Adjective"})
+        self.assertEqual(grammar.output_sentence("Start"), "happy")
+
+    def test_freeze_loads_every_block(self):
+        """Tests that freezing a LazyGrammar that has loaded nothing, as seeded and
+        parallel generation do, parses every block first"""
+        path = self.write('grammar.txt', '{\nS\n1 [A] [A]\n}\n{\nA\n1 x\n1 y\n}\n')
+        expected = list(generate_range(grammar_parser(path), "S", 1, 0, 20))
+        self.assertEqual(generate_parallel(LazyGrammar(path), "S", 20, workers = 2, seed = 1), expected)
+        self.assertEqual(set(LazyGrammar(path).freeze().rules), {"S", "A"})
+
+    def test_constraints_and_vocabulary(self):
+        """Tests that helpers walking the rules see blocks that are not parsed yet"""
+        path = self.write('grammar.txt', '{\nS\n1 [A] [B]\n}\n{\nA\n1 x\n1 y\n}\n'
+                                         '{\nB\n1 x\n3 z\n}\n{\nUnused\n1 never\n}\n')
+        sampler = constrained_sampler(LazyGrammar(path), "S", contains = "x")
+        self.assertAlmostEqual(sampler.probability, 5 / 8)
+        self.assertEqual(Vocabulary.from_grammar(LazyGrammar(path)).words, ["never", "x", "y", "z"])
+
+    def test_persisted_index(self):
+        """Tests that an index saved next to the grammar is used by later loads"""
+        path = self.write('grammar.txt', '{\nStart\n1 hello\n}\n')
+        LazyGrammar(path, persist_index = True)
+        self.assertTrue(os.path.exists(path + grammar_loader.INDEX_SUFFIX))
+        grammar_loader.clear_cache()
+        self.assertEqual(LazyGrammar(path, persist_index = True).output_sentence("Start"), "hello")
+
+    def test_broken_persisted_index(self):
+        """Tests that a truncated or malformed saved index is scanned again"""
+        path = self.write('grammar.txt', '{\nStart\n1 hello\n}\n')
+        LazyGrammar(path, persist_index = True)
+        with open(path + grammar_loader.INDEX_SUFFIX) as file:
+            stored = file.read()
+
+        for broken in [stored[:len(stored) // 2], '[]', stored.replace('"Start"', '7')]:
+            with open(path + grammar_loader.INDEX_SUFFIX, 'w') as file:
+                file.write(broken)
+            grammar_loader.clear_cache()
+            self.assertEqual(LazyGrammar(path, persist_index = True).output_sentence("Start"), "hello")
+            with open(path + grammar_loader.INDEX_SUFFIX) as file:
+                self.assertEqual(file.read(), stored)
+        self.assertEqual(sorted(os.listdir(self.directory.name)), ['grammar.txt', 'grammar.txt.index.json'])
+
+
+class TestFrozenGrammar(unittest.TestCase):
+    """Test class for sharing a frozen grammar between threads"""
+    def setUp(self):
+        self.grammar = grammar_parser("grammar_file_input.txt")
+        self.sentences = {f"Boo is {adjective} today"
+                          for adjective in ["happy", "perfect", "relaxing", "fulfilled", "excited"]}
+
+    def test_frozen_matches_unfrozen(self):
+        """Tests that freezing does not change which options are picked"""
+        self.grammar.random = random.Random(5)
+        expected = [self.grammar.output_sentence("HowIsBoo") for x in range(200)]
+        view = self.grammar.freeze().with_random(random.Random(5))
+        self.assertEqual([view.output_sentence("HowIsBoo") for x in range(200)], expected)
+
+    def test_frozen_is_read_only(self):
+        """Tests that rules cannot be added once the grammar is frozen"""
+        self.grammar.freeze()
+        with self.assertRaises(RuntimeError):
+            self.grammar.add_rule(Rule("Hello", []))
+
+    def test_with_random_requires_frozen(self):
+        """Tests that views can only be taken of frozen grammars"""
+        with self.assertRaises(RuntimeError):
+            self.grammar.with_random(random.Random())
+
+    def test_many_threads(self):
+        """Hammers one frozen grammar from many threads at once"""
+        self.grammar.freeze()
+        results = [None] * 16
+
+        def work(index):
+            results[index] = [self.grammar.output_sentence("HowIsBoo") for x in range(2000)]
+
+        threads = [threading.Thread(target = work, args = (index,)) for index in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for result in results:
+            self.assertEqual(len(result), 2000)
+            self.assertTrue(set(result) <= self.sentences)
+
+    def test_generate_parallel(self):
+        """Tests that seeded output does not depend on the number of workers"""
+        one = generate_parallel(self.grammar, "HowIsBoo", 5000, workers = 1, seed = 7, chunk_size = 100)
+        many = generate_parallel(self.grammar, "HowIsBoo", 5000, workers = 16, seed = 7, chunk_size = 100)
+        self.assertEqual(one, many)
+        self.assertEqual(len(one), 5000)
+        self.assertTrue(set(one) <= self.sentences)
+
+
+def make_grammar(text, seed = None):
+    """Builds a grammar from the text of a grammar file"""
+    grammar = Grammar()
+    for rule in grammar_loader.parse_entries(text.splitlines()):
+        grammar.add_rule(rule)
+    if seed is not None:
+        grammar.random = random.Random(seed)
+    return grammar
+
+
+class TestConstraints(unittest.TestCase):
+    """Test class for constrained sampling in constraints.py"""
+    def setUp(self):
+        self.grammar = make_grammar(
+            "{\nS\n1 [A] [B]\n}\n{\nA\n1 x\n1 y\n}\n{\nB\n1 x\n3 z\n}\n", seed = 1)
+
+    def assertFrequencies(self, sentences, expected):
+        for sentence, probability in expected.items():
+            self.assertAlmostEqual(sentences.count(sentence) / len(sentences), probability, delta = 0.02)
+        self.assertEqual(set(sentences), set(expected))
+
+    def test_contains(self):
+        """Tests that sentences containing a word keep their relative odds"""
+        sampler = constrained_sampler(self.grammar, "S", contains = "x")
+        self.assertAlmostEqual(sampler.probability, 5 / 8)
+        self.assertFrequencies(sampler.samples(20000), {"x x": 1 / 5, "x z": 3 / 5, "y x": 1 / 5})
+
+    def test_prefix(self):
+        """Tests that sentences starting with a prefix keep their relative odds"""
+        sampler = constrained_sampler(self.grammar, "S", prefix = "y")
+        self.assertAlmostEqual(sampler.probability, 1 / 2)
+        self.assertFrequencies(sampler.samples(20000), {"y x": 1 / 4, "y z": 3 / 4})
+
+    def test_recursive_prefix(self):
+        """Tests a prefix that can only come from recursive expansions"""
+        grammar = make_grammar("{\nS\n1 a [S]\n1 b\n}\n", seed = 2)
+        sampler = constrained_sampler(grammar, "S", prefix = ["a", "a"])
+        self.assertAlmostEqual(sampler.probability, 1 / 4)
+        for sentence in sampler.samples(1000):
+            self.assertTrue(sentence.startswith("a a "))
+            self.assertTrue(sentence.endswith(" b"))
+
+    def test_impossible(self):
+        """Tests that a constraint no sentence can meet is rejected"""
+        with self.assertRaises(ValueError):
+            constrained_sampler(self.grammar, "S", contains = "w")
+        with self.assertRaises(ValueError):
+            constrained_sampler(self.grammar, "S")
+
+
+class TestDerivation(GrammarFileTestCase):
+    """Test class for derivation trees in derivation.py"""
+    GRAMMAR = "{\nS\n1 a [S] [B]\n2 [B]\n}\n{\nB\n1 x\n3 y z\n}\n"
+
+    def setUp(self):
+        super().setUp()
+        self.grammar = make_grammar(self.GRAMMAR, seed = 3)
+        self.encoder = DerivationEncoder(self.grammar)
+
+    def test_same_sentences_as_output_sentence(self):
+        """Tests that derivations use the same random draws as output_sentence"""
+        derived = [self.encoder.sentence(self.encoder.derive("S")) for x in range(200)]
+        self.grammar.random = random.Random(3)
+        self.assertEqual(derived, [self.grammar.output_sentence("S") for x in range(200)])
+
+    def test_decode(self):
+        """Tests decoding a hand-written derivation into a tree"""
+        tree = self.encoder.decode([0, 0, 0, 1, 1, 0, 1, 1])
+        self.assertEqual(tree, {
+            'rule': 'S', 'option': 0, 'children': [
+                'a',
+                {'rule': 'S', 'option': 1, 'children': [{'rule': 'B', 'option': 0, 'children': ['x']}]},
+                {'rule': 'B', 'option': 1, 'children': ['y', 'z']}]})
+
+    def test_write_and_read(self):
+        """Tests streaming derivations to a binary file and reading them back"""
+        path = os.path.join(self.directory.name, "derivations.bin")
+        self.assertEqual(write_derivations(path, self.encoder, "S", 300), 300)
+        derivations = list(read_derivations(path))
+
+        self.assertEqual(len(derivations), 300)
+        self.grammar.random = random.Random(3)
+        self.assertEqual([self.encoder.sentence(derivation) for derivation in derivations],
+                         [self.grammar.output_sentence("S") for x in range(300)])
+
+    def test_rule_names_stored(self):
+        """Tests that the file records the rule ids, so a reader numbering the rules
+        differently is caught instead of decoding the wrong rules"""
+        path = os.path.join(self.directory.name, "derivations.bin")
+        write_derivations(path, self.encoder, "S", 10)
+        self.assertEqual(read_rule_names(path), ["S", "B"])
+        self.assertEqual(len(list(read_derivations(path, self.encoder))), 10)
+        with self.assertRaises(ValueError):
+            list(read_derivations(path, DerivationEncoder(self.grammar, ["B", "S"])))
+
+    def test_lazy_rule_ids(self):
+        """Tests that a LazyGrammar numbers its rules in file order, whichever were
+        loaded first"""
+        grammar = LazyGrammar(self.write("grammar.txt", self.GRAMMAR))
+        grammar.get_rule("B")
+        self.assertEqual(DerivationEncoder(grammar).rule_names, ["S", "B"])
+
+    def test_decode_with_lazy_grammar(self):
+        """Tests decoding a file with a LazyGrammar that has not loaded any rules"""
+        path = os.path.join(self.directory.name, "derivations.bin")
+        write_derivations(path, self.encoder, "S", 50)
+        encoder = DerivationEncoder(LazyGrammar(self.write("grammar.txt", self.GRAMMAR)), read_rule_names(path))
+        derivations = list(read_derivations(path, encoder))
+        self.grammar.random = random.Random(3)
+        self.assertEqual([encoder.sentence(derivation) for derivation in derivations],
+                         [self.grammar.output_sentence("S") for x in range(50)])
+        self.assertEqual(encoder.decode(derivations[0])['rule'], "S")
+
+    def test_truncated(self):
+        """Tests that a file cut off in the middle of a record is reported"""
+        path = os.path.join(self.directory.name, "derivations.bin")
+        write_derivations(path, self.encoder, "S", 20)
+        size = os.path.getsize(path)
+        for cut in (4, 2):
+            with open(path, 'r+b') as file:
+                file.truncate(size - cut)
+            with self.assertRaises(ValueError):
+                list(read_derivations(path))
+
+    def test_read_in_chunks(self):
+        """Tests that records spanning several reads come back whole"""
+        path = os.path.join(self.directory.name, "derivations.bin")
+        write_derivations(path, self.encoder, "S", 300)
+        expected = list(read_derivations(path))
+        with mock.patch.object(derivation, 'READ_BUFFER_SIZE', 3):
+            self.assertEqual(list(read_derivations(path)), expected)
+
+
+class TestScenarios(unittest.TestCase):
+    """Test class for the scenario harness in project4_scenarios.py"""
+    def setUp(self):
+        grammar = "{\nS\n1 [A] [A]\n}\n{\nA\n1 x\n1 y\n}\n"
+        self.scenarios = [
+            Scenario(f"seed {seed}", grammar, 20, "S", self.expected(grammar, seed), seed)
+            for seed in range(4)]
+        self.scenarios.append(Scenario("wrong", grammar, 1, "S", ["z z"], 0))
+
+    def expected(self, grammar, seed):
+        grammar = make_grammar(grammar)
+        random.seed(seed)
+        return [grammar.output_sentence("S") for x in range(20)]
+
+    def check(self, results):
+        self.assertEqual([result.passed for result in results], [True] * 4 + [False])
+
+    def test_subprocess(self):
+        """Tests running scenarios concurrently in subprocesses"""
+        self.check(run_scenarios(self.scenarios, workers = 4))
+
+    def test_in_process(self):
+        """Tests running scenarios in worker processes that import project4 once"""
+        self.check(run_scenarios(self.scenarios, workers = 2, in_process = True))
+
+
+def sentence_distribution(grammar, variable):
+    """Returns the exact probability of every sentence of a non-recursive grammar"""
+    rule = grammar.rules[variable]
+    total = sum(option.weight for option in rule.options)
+    distribution = {}
+    for option in rule.options:
+        partial = {(): Fraction(option.weight, total)}
+        for symbol in option.symbols:
+            if isinstance(symbol, VariableSymbol):
+                choices = sentence_distribution(grammar, symbol.name)
+            else:
+                choices = {symbol.value: Fraction(1)}
+            partial = {words + (text,): probability * choice
+                       for words, probability in partial.items() for text, choice in choices.items()}
+        for words, probability in partial.items():
+            sentence = ' '.join(words)
+            distribution[sentence] = distribution.get(sentence, 0) + probability
+    return distribution
+
+
+class TestOptimizer(unittest.TestCase):
+    """Test class for the grammar optimizer in optimizer.py"""
+    def setUp(self):
+        self.grammar = make_grammar(
+            "{\nS\n1 the [Noun] [Verb] now\n2 [Phrase] [Noun]\n1 the [Noun] [Verb] now\n1\n}\n"
+            "{\nPhrase\n1 a big [Adj]\n}\n"
+            "{\nAdj\n1 red\n}\n"
+            "{\nNoun\n1 cat\n2 dog\n1 cat\n}\n"
+            "{\nAnimal\n2 cat\n2 dog\n}\n"
+            "{\nVerb\n1 runs\n1 [Empty]\n}\n"
+            "{\nEmpty\n1\n}\n")
+
+    def test_same_distribution(self):
+        """Tests that every sentence keeps exactly the same probability"""
+        optimized, report = optimize(self.grammar)
+        self.assertEqual(sentence_distribution(optimized, "S"), sentence_distribution(self.grammar, "S"))
+
+    def test_shrinks(self):
+        """Tests that each pass shrinks the grammar and the report says so"""
+        optimized, report = optimize(self.grammar)
+        self.assertEqual(report.merged_options, 2)
+        self.assertEqual(report.merged_rules, 1)
+        self.assertTrue(report.fused_terminals > 0 and report.inlined_variables > 0)
+        self.assertTrue(all(after < before for before, after in zip(report.before, report.after)))
+        self.assertIs(optimized.rules["Animal"], optimized.rules["Noun"])
+        self.assertEqual([option.symbols[0].value for option in optimized.rules["S"].options[1:2]],
+                         ["a big red"])
+        self.assertIn("rules: 7 ->", str(report))
+
+    def test_original_unchanged(self):
+        """Tests that the original grammar is left as it was"""
+        optimize(self.grammar)
+        self.assertEqual(len(self.grammar.rules["Noun"].options), 3)
+        self.assertEqual(len(self.grammar.rules["S"].options[0].symbols), 4)
+
+
+class TestSinks(GrammarFileTestCase):
+    """Test class for the output sinks in sinks.py and generate_corpus"""
+    def setUp(self):
+        super().setUp()
+        self.grammar = grammar_parser("grammar_file_input.txt")
+        self.grammar.random = random.Random(4)
+        self.expected = [self.grammar.output_sentence("HowIsBoo") for x in range(2500)]
+        self.grammar.random = random.Random(4)
+
+    def check(self, name, opener, use_process = False):
+        path = os.path.join(self.directory.name, name)
+        with BackgroundWriter(path, queue_size = 2, use_process = use_process) as writer:
+            generate_corpus(self.grammar, "HowIsBoo", 2500, writer, batch_size = 100)
+        with opener(path, 'rt', encoding = 'utf-8') as file:
+            self.assertEqual(file.read().splitlines(), self.expected)
+
+    def test_plain(self):
+        self.check("corpus.txt", open)
+
+    def test_gzip(self):
+        self.check("corpus.txt.gz", gzip.open)
+
+    def test_bz2(self):
+        self.check("corpus.txt.bz2", bz2.open)
+
+    def test_xz_in_process(self):
+        """Tests compressing in a separate writer process"""
+        self.check("corpus.txt.xz", lzma.open, use_process = True)
+
+    def test_unknown_compression(self):
+        """Tests that errors in the writer thread are raised by close()"""
+        writer = BackgroundWriter(os.path.join(self.directory.name, "corpus"), compression = "zip")
+        with self.assertRaises(ValueError):
+            writer.close()
+
+    def check_fails_early(self, error, use_process = False):
+        """Tests that write_batch raises once the writer has failed, instead of the
+        failure only showing up in close()"""
+        path = os.path.join(self.directory.name, "missing", "corpus.txt")
+        writer = BackgroundWriter(path, queue_size = 1, use_process = use_process)
+        with self.assertRaises(error):
+            for x in range(1000):
+                writer.write_batch(["lost"])
+        with self.assertRaises(error):
+            writer.close()
+
+    def test_write_fails_early(self):
+        self.check_fails_early(FileNotFoundError)
+
+    def test_write_fails_early_in_process(self):
+        self.check_fails_early(RuntimeError, use_process = True)
+
+    def test_body_error_kept(self):
+        """Tests that a failing writer does not hide the error of the with body"""
+        with self.assertRaises(KeyError):
+            with BackgroundWriter(os.path.join(self.directory.name, "corpus"), compression = "zip"):
+                raise KeyError("body")
+
+
+class TestRandomAccess(unittest.TestCase):
+    """Test class for counter-based generation in random_access.py"""
+    def setUp(self):
+        self.grammar = make_grammar("{\nS\n1 [A] [A] [A]\n}\n{\nA\n1 x\n1 y\n2 z\n}\n")
+
+    def test_sentence_at(self):
+        """Tests that any sentence can be made on its own"""
+        corpus = list(generate_range(self.grammar, "S", 9, 0, 500))
+        self.assertEqual([sentence_at(self.grammar, "S", 9, index) for index in (0, 123, 499)],
+                         [corpus[0], corpus[123], corpus[499]])
+        self.assertNotEqual(corpus, list(generate_range(self.grammar, "S", 10, 0, 500)))
+
+    def test_shards(self):
+        """Tests that the shards of a corpus put together make the whole corpus"""
+        corpus = list(generate_range(self.grammar, "S", 9, 0, 1000))
+        shards = []
+        for shard in range(7):
+            shards.extend(generate_range(self.grammar, "S", 9, *shard_range(1000, shard, 7)))
+        self.assertEqual(shards, corpus)
+
+    def test_splitmix(self):
+        """Tests SplitMix64 against its reference output and that restarting a
+        stream repeats it"""
+        self.assertEqual(splitmix64(0), 0xE220A8397B1DCDAF)
+        generator = SplitMixRandom(9, 5)
+        first = [generator.random() for x in range(100)]
+        self.assertTrue(all(0 <= value < 1 for value in first))
+        generator.start(5)
+        self.assertEqual([generator.random() for x in range(100)], first)
+        generator.start(6)
+        self.assertNotEqual(generator.random(), first[0])
+
+    def test_bad_shard_or_range(self):
+        """Tests that corpus.py reports a bad --shard or --range as a usage error"""
+        for option in (['--shard', '5/4'], ['--shard', '1/0'], ['--shard', '-1/4'], ['--shard', '1-4'],
+                       ['--range', '5:2'], ['--range', '1:2:3']):
+            with self.subTest(option = option), \
+                    mock.patch('sys.argv', ['corpus.py', 'grammar_file_input.txt', '10', 'HowIsBoo',
+                                            '--seed', '1'] + option), \
+                    mock.patch('sys.stderr'), self.assertRaises(SystemExit) as raised:
+                corpus.main()
+            self.assertEqual(raised.exception.code, 2)
+
+    def test_parallel_matches(self):
+        """Tests that seeded parallel generation makes the same corpus"""
+        corpus = list(generate_range(self.grammar, "S", 9, 0, 1000))
+        self.assertEqual(generate_parallel(self.grammar, "S", 1000, workers = 4, seed = 9, chunk_size = 64),
+                         corpus)
+
+
+class TestVocabulary(GrammarFileTestCase):
+    """Test class for token output in vocabulary.py"""
+    def setUp(self):
+        super().setUp()
+        self.grammar = make_grammar("{\nS\n1 the [A] [A]\n2 [A] end\n}\n{\nA\n1 x\n1 y\n2 z\n}\n")
+
+    def test_stable_ids(self):
+        """Tests that words are numbered in sorted order"""
+        self.assertEqual(Vocabulary.from_grammar(self.grammar).words, ["end", "the", "x", "y", "z"])
+
+    def test_same_sentences_as_output_sentence(self):
+        """Tests that token ids spell out the sentences output_sentence makes"""
+        optimized, report = optimize(self.grammar)
+        vocabulary = Vocabulary.from_grammar(optimized)
+        optimized.random = random.Random(13)
+        expected = [optimized.output_sentence("S") for x in range(300)]
+        optimized.random = random.Random(13)
+        for sentence in expected:
+            tokens = array.array('I')
+            self.assertTrue(generate_tokens(optimized, vocabulary, "S", tokens))
+            self.assertEqual([vocabulary.words[token] for token in tokens], sentence.split())
+
+    def test_token_corpus(self):
+        """Tests writing a token corpus and mapping it back"""
+        prefix = os.path.join(self.directory.name, "corpus")
+        write_token_corpus(prefix, self.grammar, "S", 50, seed = 2, first = 100)
+        corpus = TokenCorpus(prefix)
+        try:
+            self.assertEqual(len(corpus), 50)
+            self.assertEqual([corpus.sentence(index) for index in range(50)],
+                             list(generate_range(self.grammar, "S", 2, 100, 150)))
+            self.assertEqual(len(corpus.tokens), corpus.offsets[50])
+        finally:
+            corpus.close()
+
+    def test_failed_sentences_kept(self):
+        """Tests that a sentence that fails to generate still takes its place"""
+        grammar = make_grammar("{\nS\n1 [A]\n1 [Z]\n}\n{\nA\n1 x\n}\n{\nZ\n0 z\n}\n")
+        prefix = os.path.join(self.directory.name, "corpus")
+        with mock.patch('sys.stdout'):
+            write_token_corpus(prefix, grammar, "S", 50, seed = 2)
+        corpus = TokenCorpus(prefix)
+        try:
+            self.assertEqual(len(corpus), 50)
+            self.assertEqual({corpus.sentence(index) for index in range(50)}, {"x", ""})
+        finally:
+            corpus.close()
+
+
 class TestRule(unittest.TestCase):
     """Test class for Rule class"""
     def test_generate_rule(self):
         pass
 
+    def test_set_weight(self):
+        """Tests that changed and fractional weights are used by later picks"""
+        grammar = make_grammar("{\nA\n1 x\n1 y\n1 z\n}\n", seed = 6)
+        rule = grammar.rules["A"]
+        rule.set_weight(0, 0)
+        rule.set_weight(1, 0.5)
+        rule.set_weight(2, 1.5)
+        sentences = [grammar.output_sentence("A") for x in range(20000)]
+        self.assertNotIn("x", sentences)
+        self.assertAlmostEqual(sentences.count("y") / len(sentences), 0.25, delta = 0.02)
+        self.assertEqual([option.weight for option in rule.options], [0, 0.5, 1.5])
+
+    def test_set_weight_keeps_seed(self):
+        """Tests that the tree picks the same options as the scan for the same seed"""
+        grammar = make_grammar("{\nA\n3 x\n0 y\n1 z\n2 w\n}\n", seed = 8)
+        expected = [grammar.output_sentence("A") for x in range(500)]
+        grammar.rules["A"].set_weight(1, 0)
+        grammar.random = random.Random(8)
+        self.assertEqual([grammar.output_sentence("A") for x in range(500)], expected)
+
+    def test_set_weight_errors(self):
+        """Tests that bad indexes and weights and frozen rules are rejected"""
+        rule = Rule("A", [Option(1, [TerminalSymbol("x")])])
+        with self.assertRaises(ValueError):
+            rule.set_weight(0, -1)
+        with self.assertRaises(ValueError):
+            rule.set_weight(0, float('nan'))
+        with self.assertRaises(ValueError):
+            rule.set_weight(0, float('inf'))
+        with self.assertRaises(IndexError):
+            rule.set_weight(-1, 3)
+        with self.assertRaises(IndexError):
+            rule.set_weight(1, 3)
+        rule.freeze()
+        with self.assertRaises(RuntimeError):
+            rule.set_weight(0, 2)
+
+    def test_set_weight_copies_shared_options(self):
+        """Tests that changing a weight does not reach other grammars"""
+        first = grammar_parser("grammar_file_input.txt")
+        second = grammar_parser("grammar_file_input.txt")
+        first.rules["Adjective"].set_weight(0, 10)
+        self.assertEqual(second.rules["Adjective"].options[0].weight, 3)
+
+
+class TestFenwickTree(unittest.TestCase):
+    """Test class for FenwickTree in fenwick.py"""
+    def test_find_matches_scan(self):
+        """Tests find against a linear scan that skips zero weights, including ties"""
+        generator = random.Random(12)
+        weights = [generator.choice([0, 1, 2, 5]) for x in range(37)]
+        tree = FenwickTree(weights)
+        for x in range(200):
+            index = generator.randrange(len(weights))
+            weights[index] = generator.choice([0, 1, 3])
+            tree.set(index, weights[index])
+            value = generator.choice([0, generator.randint(0, sum(weights)), generator.uniform(0, sum(weights))])
+            running = 0
+            expected = len(weights)
+            for position, weight in enumerate(weights):
+                running += weight
+                if weight > 0 and value <= running:
+                    expected = position
+                    break
+            self.assertEqual(tree.find(value), expected)
+            self.assertEqual(tree.total(), sum(weights))
+
+    def test_long_zero_runs(self):
+        """Tests that picks landing in long runs of zero weights, or just past the
+        end, move to the closest positive weight"""
+        tree = FenwickTree([0] * 50000 + [2] + [0] * 50000 + [3] + [0] * 50000)
+        self.assertEqual(tree.find(0), 50000)
+        self.assertEqual(tree.find(5.000001), 100001)
+        self.assertEqual(tree._nearest_positive(75000), 100001)
+        self.assertEqual(tree._nearest_positive(120000), 100001)
+        tree.set(100001, 0)
+        self.assertEqual(tree._nearest_positive(120000), 50000)
+        tree.set(50000, 0)
+        self.assertEqual(tree.find(0), len(tree.weights))
+
+    def test_many_fractional_updates(self):
+        """Tests that rounding error from many fractional updates never picks a zero
+        weight and that setting every weight to zero gives an exact zero total"""
+        generator = random.Random(14)
+        rule = Rule("A", [Option(1, [TerminalSymbol(f"w{index}")]) for index in range(1000)])
+        grammar = Grammar()
+        grammar.add_rule(rule)
+        grammar.random = generator
+
+        for x in range(200000):
+            index = generator.randrange(1000)
+            rule.set_weight(index, rule.options[index].weight * generator.choice([0.9, 1.1, 0.37]) + 0.001)
+        weights = [option.weight for option in rule.options]
+        self.assertAlmostEqual(rule.weight_tree.total(), sum(weights), delta = 1e-9 * sum(weights))
+
+        for index in range(0, 1000, 2):
+            rule.set_weight(index, 0.0)
+        for x in range(5000):
+            self.assertEqual(int(grammar.output_sentence("A")[1:]) % 2, 1)
+
+        for index in range(1, 1000, 2):
+            rule.set_weight(index, 0.0)
+        self.assertEqual(rule.weight_tree.total(), 0)
+        self.assertIsNone(rule.choose_option(grammar))
+
 
 class TestOption(unittest.TestCase):
     """Test class for Option class"""
     def test_generate_option(self):
         grammar = Grammar()
         options = [Option(1, [TerminalSymbol("Option"), TerminalSymbol("Working")])]
-        result = options.generate_option(grammar)
+        result = options[0].generate_option(grammar)
         expected = "Option Working"
         self.assertEqual(result, expected)
 
@@ -83,16 +752,70 @@ class TestMain(unittest.TestCase):
         sent_num = 10
         start_var = "HowIsBoo"
 
+        start_input = TestDoubleInput([file, str(sent_num), start_var])
         start_output = TestDoubleOutput()
-        print_builtin = print
-        print = start_output.write
-
-        main()
 
-        print = print_builtin
+        with mock.patch('builtins.input', start_input.read), \
+                mock.patch('builtins.print', lambda *args: start_output.add_text(' '.join(map(str, args)) + '\n')):
+            main()
 
         final_output = start_output.output()
         self.assertTrue(final_output.strip())
+        self.assertEqual(len(final_output.splitlines()), sent_num)
+
+
+class TestConformance(unittest.TestCase):
+    """Test class for the engine conformance harness in conformance.py"""
+    def test_chi_square_sf(self):
+        """Tests the chi-square tail against table values"""
+        self.assertAlmostEqual(chi_square_sf(3.841, 1), 0.05, places = 4)
+        self.assertAlmostEqual(chi_square_sf(18.307, 10), 0.05, places = 4)
+        self.assertEqual(chi_square_sf(0, 3), 1.0)
+
+    def test_engines_conform(self):
+        """Runs every check of every engine on small synthetic grammars"""
+        results = run_conformance(ENGINES, grammar_count = 2, draws = 3000, sentences = 1000, seed = 1)
+        self.assertTrue(results)
+        for result in results:
+            self.assertTrue(result.passed, str(result))
+
+    def test_detects_wrong_weights(self):
+        """Tests that an engine ignoring the weights is caught"""
+        class UniformEngine(Engine):
+            name = 'uniform'
+
+            def choose(self, bound, variable):
+                return bound.random.randrange(len(bound.rules[variable].options))
+
+        grammar = make_grammar("{\nA\n1 x\n9 y\n}\n")
+        result = check_option_frequencies(UniformEngine(), grammar, 5000, random.Random(2), 1e-6)
+        self.assertFalse(result.passed)
+
+    def test_updates_checked_against_new_weights(self):
+        """Tests that the update engine is checked against the weights it set, and
+        that checking it against the original weights fails"""
+        class StaleEngine(UpdateEngine):
+            name = 'stale'
+
+            def option_weights(self, state, variable):
+                return Engine().option_weights(grammar, variable)
+
+        grammar = make_grammar("{\nA\n1 x\n9 y\n3 z\n}\n")
+        self.assertTrue(check_option_frequencies(UpdateEngine(), grammar, 5000, random.Random(2), 1e-6).passed)
+        self.assertFalse(check_option_frequencies(StaleEngine(), grammar, 5000, random.Random(2), 1e-6).passed)
+
+    def test_detects_different_boundary(self):
+        """Tests that an engine drawing differently for a seed is caught"""
+        class SkippingEngine(ReferenceEngine):
+            name = 'skipping'
+
+            def sentence(self, bound, start_variable):
+                grammar, generator = bound
+                generator.random()
+                return super().sentence(bound, start_variable)
+
+        grammar = make_synthetic_grammar(random.Random(3))
+        self.assertFalse(check_seed_equality(SkippingEngine(), grammar, "R0", 100, 4).passed)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,207 @@
+import array
+import ast
+import mmap
+import struct
+import sys
+from random_access import SplitMixRandom
+from symbols import VariableSymbol
+
+
+# Size of the header written at the start of each .npy file. It is fixed so the
+# header can be rewritten with the final length once writing is done.
+_NPY_HEADER_SIZE = 128
+
+# Number of token ids collected before TokenCorpusWriter writes to the file
+WRITE_BUFFER_SIZE = 1 << 16
+
+
+class Vocabulary:
+    """Class for giving every word of a grammar's terminals a stable integer id"""
+    def __init__(self, words):
+        """Numbers the words in the given order"""
+        self.words = list(words)
+        self.ids = {word: token_id for token_id, word in enumerate(self.words)}
+        self.terminal_ids = {}
+
+    @classmethod
+    def from_grammar(cls, grammar):
+        """Builds the vocabulary of a grammar. Words are numbered in sorted order,
+        so the ids do not depend on the order of the rules in the file. A
+        LazyGrammar parses all of its blocks to find every word."""
+        rules = [grammar.get_rule(name) for name in grammar.rule_names()]
+        values = {symbol.value for rule in rules for option in rule.options
+                  for symbol in option.symbols if not isinstance(symbol, VariableSymbol)}
+        vocabulary = cls(sorted({word for value in values for word in value.split()}))
+        for value in values:
+            vocabulary.terminal_tokens(value)
+        return vocabulary
+
+    @classmethod
+    def load(cls, path):
+        """Reads a vocabulary file with one word per line"""
+        with open(path, 'r', encoding = 'utf-8') as file:
+            return cls(file.read().splitlines())
+
+    def save(self, path):
+        """Writes the vocabulary file, one word per line in id order"""
+        with open(path, 'w', encoding = 'utf-8') as file:
+            file.writelines(word + '\n' for word in self.words)
+
+    def terminal_tokens(self, value):
+        """Returns the ids of the words of a terminal, which is worked out only once
+        per terminal (a terminal holds several words after optimizer fuses them)"""
+        if value not in self.terminal_ids:
+            self.terminal_ids[value] = tuple(self.ids[word] for word in value.split())
+        return self.terminal_ids[value]
+
+
+def generate_tokens(grammar, vocabulary, variable, tokens):
+    """Appends the token ids of one random sentence to an array('I') without
+    building any strings, and returns whether generation succeeded. It draws the
+    same random numbers as Grammar.output_sentence."""
+    rule = grammar.get_rule(variable)
+    if rule is None:
+        return False
+
+    index = rule.choose_option(grammar)
+    if index is None:
+        return False
+
+    for symbol in rule.options[index].symbols:
+        if isinstance(symbol, VariableSymbol):
+            if not generate_tokens(grammar, vocabulary, symbol.name, tokens):
+                return False
+        else:
+            tokens.extend(vocabulary.terminal_tokens(symbol.value))
+    return True
+
+
+def _npy_header(descr, length):
+    """Returns the .npy version 1.0 header of a one-dimensional array"""
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': ({length},), }}"
+    header = header.ljust(_NPY_HEADER_SIZE - 10 - 1) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+def _write_array(file, values):
+    """Writes an array to a file in little-endian order"""
+    if sys.byteorder == 'big':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    values.tofile(file)
+
+
+class TokenCorpusWriter:
+    """Writes sentences of token ids to <prefix>.tokens.npy, a flat uint32 array,
+    and <prefix>.offsets.npy, a uint64 array where sentence i is
+    tokens[offsets[i]:offsets[i + 1]]. Both files can be opened with numpy.load
+    or with load_token_corpus."""
+    def __init__(self, prefix):
+        """Opens both files with room for their headers"""
+        self.tokens_file = open(prefix + '.tokens.npy', 'wb')
+        self.offsets_file = open(prefix + '.offsets.npy', 'wb')
+        self.tokens_file.write(_npy_header('<u4', 0))
+        self.offsets_file.write(_npy_header('<u8', 0))
+
+        self.token_count = 0
+        self.sentence_count = 0
+        self.tokens = array.array('I')
+        self.offsets = array.array('Q', [0])
+
+    def write_sentence(self, tokens):
+        """Adds the token ids of one sentence"""
+        self.tokens.extend(tokens)
+        self.token_count += len(tokens)
+        self.sentence_count += 1
+        self.offsets.append(self.token_count)
+
+        if len(self.tokens) >= WRITE_BUFFER_SIZE:
+            self._flush()
+
+    def _flush(self):
+        _write_array(self.tokens_file, self.tokens)
+        _write_array(self.offsets_file, self.offsets)
+        self.tokens = array.array('I')
+        self.offsets = array.array('Q')
+
+    def close(self):
+        """Writes what is left and fills in the final lengths of both arrays"""
+        self._flush()
+        for file, descr, length in ((self.tokens_file, '<u4', self.token_count),
+                                    (self.offsets_file, '<u8', self.sentence_count + 1)):
+            file.seek(0)
+            file.write(_npy_header(descr, length))
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_token_corpus(prefix, grammar, start_variable, count, seed = None, first = 0):
+    """Writes <prefix>.vocab.txt and a token corpus of count sentences. With a seed,
+    they are sentences first to first + count of that seed's corpus, the same as
+    random_access would give. A sentence that fails to generate is written as an
+    empty sentence. Returns the vocabulary."""
+    vocabulary = Vocabulary.from_grammar(grammar)
+    vocabulary.save(prefix + '.vocab.txt')
+
+    if seed is not None and not grammar.frozen:
+        grammar.freeze()
+
+    view = grammar
+    if seed is not None:
+        generator = SplitMixRandom(seed, first)
+        view = grammar.with_random(generator)
+
+    with TokenCorpusWriter(prefix) as writer:
+        for index in range(first, first + count):
+            if seed is not None:
+                generator.start(index)
+            tokens = array.array('I')
+            if not generate_tokens(view, vocabulary, start_variable, tokens):
+                # Keeps sentence i at offset i, so shards and ranges still line up
+                tokens = array.array('I')
+            writer.write_sentence(tokens)
+
+    return vocabulary
+
+
+def _map_npy(path):
+    """Maps a .npy file into memory and returns the map with a memoryview of its data"""
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+
+    header_length = struct.unpack('<H', mapped[8:10])[0]
+    header = ast.literal_eval(mapped[10:10 + header_length].decode('latin1'))
+    typecode = {'<u4': 'I', '<u8': 'Q'}[header['descr']]
+    return mapped, memoryview(mapped)[10 + header_length:].cast('B').cast(typecode)
+
+
+class TokenCorpus:
+    """Class for reading a token corpus through memory maps without copying it.
+    The views use the machine's byte order, which is little-endian as written."""
+    def __init__(self, prefix):
+        """Maps the token and offset files and reads the vocabulary"""
+        self._tokens_map, self.tokens = _map_npy(prefix + '.tokens.npy')
+        self._offsets_map, self.offsets = _map_npy(prefix + '.offsets.npy')
+        self.vocabulary = Vocabulary.load(prefix + '.vocab.txt')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        """Returns a memoryview of the token ids of one sentence"""
+        return self.tokens[self.offsets[index]:self.offsets[index + 1]]
+
+    def sentence(self, index):
+        """Turns one sentence back into text"""
+        return ' '.join(self.vocabulary.words[token] for token in self[index])
+
+    def close(self):
+        self.tokens.release()
+        self.offsets.release()
+        self._tokens_map.close()
+        self._offsets_map.close()